@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from core.generation import generate_wave, apply_fourier_transform
+from core.colormap import quantize, get_lut, apply_lut
+from core.sequence import load_sequence_config, make_sequence, SEQUENCE_PARAMS
+
+# Benchmarked sizes, the quick grid is used with --quick
+NB_SAMPLES = [2, 16, 64, 150, 256, 500, 1024, 2048, 4096]
+NB_COMPONENTS = [1, 10, 100, 1000]
+QUICK_NB_SAMPLES = [16, 150, 500, 1024]
+QUICK_NB_COMPONENTS = [1, 10, 100]
+# Synthetic sequences : (components, keypoints per track, steps)
+SEQUENCE_SIZES = [(10, 10, 1000), (100, 50, 5000), (1000, 100, 10000)]
+QUICK_SEQUENCE_SIZES = [(10, 10, 1000), (100, 50, 5000)]
+
+
+def random_freq_params(nb_components, seed=0) :
+    rng = np.random.default_rng(seed)
+    return {
+        label : {
+            "frequency" : float(rng.uniform(0.1, 20.0)),
+            "amplitude" : float(rng.uniform(0.1, 10.0)),
+            "phase" : float(rng.uniform(0.0, 360.0)),
+            "angle" : float(rng.uniform(0.0, 360.0)),
+        }
+        for label in range(1, nb_components + 1)
+    }
+
+def random_sequence_config(nb_components, nb_keypoints, nb_steps, seed=0) :
+    # Every component has a track for every parameter, nb_steps steps of 10 ms
+    rng = np.random.default_rng(seed)
+    timestep = 0.01
+    duration = (nb_steps - 1) * timestep
+    config = {"timestep" : timestep}
+    for label in range(1, nb_components + 1) :
+        config[label] = {}
+        for param in SEQUENCE_PARAMS :
+            times = np.sort(rng.uniform(0.0, duration, nb_keypoints))
+            times[0], times[-1] = 0.0, duration
+            values = rng.uniform(0.0, 360.0, nb_keypoints)
+            config[label][param] = [{"time" : float(t), "value" : float(v)} for t, v in zip(times, values)]
+    return config
+
+
+class Benchmark :
+    # One measured function : name, parameters of the case, and work units per call for the throughput
+    def __init__(self, group, name, function, units, unit_name, setup=None) :
+        self.group = group
+        self.name = name
+        self.function = function
+        self.units = units
+        self.unit_name = unit_name
+        self.setup = setup
+
+    def run(self, min_time=0.2, max_repeat=1000) :
+        # Best time per call over repeated calls, then one more call under tracemalloc for the peak memory
+        if self.setup is not None :
+            self.setup()
+        self.function()
+        times = []
+        start = time.perf_counter()
+        while len(times) < max_repeat and (len(times) < 3 or time.perf_counter() - start < min_time) :
+            t0 = time.perf_counter()
+            self.function()
+            times.append(time.perf_counter() - t0)
+        tracemalloc.start()
+        self.function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        best = min(times)
+        return {
+            "group" : self.group,
+            "name" : self.name,
+            "best" : best,
+            "median" : float(np.median(times)),
+            "repeat" : len(times),
+            "throughput" : self.units / best if best > 0 else float("inf"),
+            "unit" : self.unit_name,
+            "peak_memory" : peak,
+        }
+
+
+def generation_benchmarks(nb_samples_list, nb_components_list) :
+    for nb_components in nb_components_list :
+        freq_params = random_freq_params(nb_components)
+        for nb_samples in nb_samples_list :
+            yield Benchmark(
+                "generate_wave", f"components={nb_components} nb_samples={nb_samples}",
+                lambda freq_params=freq_params, nb_samples=nb_samples : generate_wave(freq_params, 1.0, nb_samples),
+                units=nb_components * nb_samples * nb_samples, unit_name="component samples/s",
+            )
+
+def fourier_benchmarks(nb_samples_list) :
+    for nb_samples in nb_samples_list :
+        image = generate_wave(random_freq_params(10), 1.0, nb_samples)
+        for mode in ("magnitude", "phase") :
+            yield Benchmark(
+                "apply_fourier_transform", f"{mode} nb_samples={nb_samples}",
+                lambda image=image, phase=mode == "phase" : apply_fourier_transform(image, phase),
+                units=nb_samples * nb_samples, unit_name="samples/s",
+            )
+
+def colormap_benchmarks(nb_samples_list, cmap="viridis") :
+    # Normalize and colormap stage of the display : image -> table indices -> uint8 RGB
+    lut = get_lut(cmap)
+    for nb_samples in nb_samples_list :
+        image = generate_wave(random_freq_params(10), 1.0, nb_samples)
+        indices = np.empty(image.shape, dtype=np.uint16)
+        work = np.empty_like(image)
+        def normalize_colormap(image=image, indices=indices, work=work) :
+            return apply_lut(quantize(image, len(lut), out=indices, work=work), lut)
+        yield Benchmark(
+            "normalize_colormap", f"{cmap} nb_samples={nb_samples}",
+            normalize_colormap, units=nb_samples * nb_samples, unit_name="pixels/s",
+        )
+
+def sequence_benchmarks(sizes, directory) :
+    for nb_components, nb_keypoints, nb_steps in sizes :
+        config = random_sequence_config(nb_components, nb_keypoints, nb_steps)
+        case = f"components={nb_components} keypoints={nb_keypoints} steps={nb_steps}"
+        filename = os.path.join(directory, f"sequence_{nb_components}_{nb_keypoints}_{nb_steps}.json")
+        with open(filename, "w") as file :
+            json.dump(config, file)
+        yield Benchmark(
+            "load_sequence_config", case,
+            lambda filename=filename : load_sequence_config(filename),
+            units=nb_components * len(SEQUENCE_PARAMS) * nb_keypoints, unit_name="keypoints/s",
+        )
+        loaded = load_sequence_config(filename)
+        # make_sequence consumes the timestep of its config, each call gets a shallow copy
+        yield Benchmark(
+            "make_sequence", case,
+            lambda loaded=loaded : make_sequence(dict(loaded)),
+            units=nb_components * len(SEQUENCE_PARAMS) * nb_steps, unit_name="values/s",
+        )
+
+
+def format_size(nb_bytes) :
+    for unit in ("B", "KiB", "MiB", "GiB") :
+        if nb_bytes < 1024 or unit == "GiB" :
+            return f"{nb_bytes:.0f} {unit}" if unit == "B" else f"{nb_bytes:.1f} {unit}"
+        nb_bytes /= 1024
+
+def format_result(result, baseline=None) :
+    line = (
+        f"{result['group']:<24} {result['name']:<44} {result['best'] * 1000:>10.3f} ms "
+        f"{result['throughput']:>12.4g} {result['unit']:<20} peak {format_size(result['peak_memory']):>10}"
+    )
+    if baseline is not None :
+        line += f"  x{baseline['best'] / result['best']:.2f} vs baseline" if result["best"] > 0 else ""
+    return line
+
+def result_key(result) :
+    return f"{result['group']}/{result['name']}"
+
+def compare(results, baseline, threshold) :
+    # Cases slower than the baseline by more than threshold (0.1 = 10 %)
+    regressions = []
+    for result in results :
+        reference = baseline.get(result_key(result))
+        if reference is not None and result["best"] > reference["best"] * (1 + threshold) :
+            regressions.append((result, reference))
+    return regressions
+
+def make_parser() :
+    parser = argparse.ArgumentParser(description="Benchmark the generation, FFT, colormap and sequence code")
+    parser.add_argument("--quick", action="store_true", help="smaller grid of cases")
+    parser.add_argument("--group", action="append", default=None, help="only run this group (repeatable)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum measuring time per case (s)")
+    parser.add_argument("--save", default=None, help="save the results as a JSON baseline")
+    parser.add_argument("--baseline", default=None, help="compare with a JSON baseline saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--output", default=None, help="also write the report to this file")
+    return parser
+
+def main(argv=None) :
+    options = make_parser().parse_args(argv)
+    nb_samples_list = QUICK_NB_SAMPLES if options.quick else NB_SAMPLES
+    nb_components_list = QUICK_NB_COMPONENTS if options.quick else NB_COMPONENTS
+    sequence_sizes = QUICK_SEQUENCE_SIZES if options.quick else SEQUENCE_SIZES
+
+    baseline = None
+    if options.baseline :
+        with open(options.baseline, "r") as file :
+            baseline = {result_key(result) : result for result in json.load(file)["results"]}
+
+    lines = [f"Python {platform.python_version()} - numpy {np.__version__} - {platform.platform()} - {os.cpu_count()} cpus"]
+    print(lines[0])
+    results = []
+    with tempfile.TemporaryDirectory() as directory :
+        groups = [
+            ("generate_wave", lambda : generation_benchmarks(nb_samples_list, nb_components_list)),
+            ("apply_fourier_transform", lambda : fourier_benchmarks(nb_samples_list)),
+            ("normalize_colormap", lambda : colormap_benchmarks(nb_samples_list)),
+            ("sequence", lambda : sequence_benchmarks(sequence_sizes, directory)),
+        ]
+        for group, benchmarks in groups :
+            if options.group and group not in options.group :
+                continue
+            for benchmark in benchmarks() :
+                result = benchmark.run(options.min_time)
+                results.append(result)
+                line = format_result(result, None if baseline is None else baseline.get(result_key(result)))
+                lines.append(line)
+                print(line, flush=True)
+
+    status = 0
+    if baseline is not None :
+        regressions = compare(results, baseline, options.threshold)
+        lines.append(f"{len(regressions)} regression(s) above {options.threshold:.0%}")
+        for result, reference in regressions :
+            lines.append(f"  {result_key(result)} : {reference['best'] * 1000:.3f} ms -> {result['best'] * 1000:.3f} ms")
+        print("\n".join(lines[-len(regressions) - 1:]))
+        status = 1 if regressions else 0
+
+    if options.save :
+        with open(options.save, "w") as file :
+            json.dump({"platform" : lines[0], "results" : results}, file, indent=1)
+    if options.output :
+        with open(options.output, "w") as file :
+            file.write("\n".join(lines) + "\n")
+    return status
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import os
+import threading
+import importlib.metadata
+import numpy as np
+from core.paths import user_cache_dir
+
+# Lookup tables already built, by (name, size)
+_luts = {}
+_luts_lock = threading.Lock()
+
+# Tables are also saved to disk : a later start loads them with numpy only, without importing matplotlib
+# Files are named after the matplotlib version that built them, a matplotlib upgrade builds them again
+LUT_CACHE_DIR = user_cache_dir("luts")
+_installed_matplotlib = []
+
+def minmax(image, block_size=1 << 16) :
+    # Min and max in a single pass over memory : each block is reduced twice while it is still in cache
+    flat = image.reshape(-1)
+    lo, hi = np.inf, -np.inf
+    for start in range(0, flat.size, block_size) :
+        block = flat[start:start + block_size]
+        lo = min(lo, block.min())
+        hi = max(hi, block.max())
+    return lo, hi
+
+def get_lut(name, size=256) :
+    # uint8 RGB table of the matplotlib colormap, entry i is the color of the values in [i / size, (i + 1) / size[
+    key = (name, size)
+    with _luts_lock :
+        if key not in _luts :
+            lut = load_cached_lut(name, size)
+            if lut is None :
+                lut = build_lut(name, size)
+                save_cached_lut(name, size, lut)
+            _luts[key] = lut
+        return _luts[key]
+
+def build_lut(name, size) :
+    # matplotlib is only imported when a table is not in the disk cache
+    import matplotlib
+    cmap = matplotlib.colormaps[name].resampled(size)
+    return np.ascontiguousarray(cmap(np.arange(size), bytes=True)[:, :3])
+
+def installed_matplotlib_version() :
+    # Read from the package metadata, without importing matplotlib ; None if it is not installed
+    if len(_installed_matplotlib) == 0 :
+        try :
+            _installed_matplotlib.append(importlib.metadata.version("matplotlib"))
+        except importlib.metadata.PackageNotFoundError :
+            _installed_matplotlib.append(None)
+    return _installed_matplotlib[0]
+
+def lut_cache_path(name, size, version) :
+    return os.path.join(LUT_CACHE_DIR, f"{name}_{size}_matplotlib-{version}.npy")
+
+def load_cached_lut(name, size) :
+    version = installed_matplotlib_version()
+    if version is None :
+        return None
+    try :
+        lut = np.load(lut_cache_path(name, size, version))
+    except (OSError, ValueError) :
+        return None
+    return lut if lut.shape == (size, 3) and lut.dtype == np.uint8 else None
+
+def save_cached_lut(name, size, lut) :
+    # The cache is an optimisation only, a read only cache directory is not an error
+    # matplotlib is already imported by build_lut, the table is saved under the version that built it
+    import matplotlib
+    try :
+        os.makedirs(LUT_CACHE_DIR, exist_ok=True)
+        # Written under a temporary name first, so a concurrent start never reads a partial table
+        path = lut_cache_path(name, size, matplotlib.__version__)
+        temp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(temp_path, lut)
+        os.replace(temp_path, path)
+    except OSError :
+        pass
+
+def preload_luts(names, size=256) :
+    for name in names :
+        get_lut(name, size)
+
+def index_dtype(size) :
+    # uint16 gathers faster than uint8 with np.take and covers the 4096 entries tables
+    return np.uint16 if size <= 1 << 16 else np.intp
+
+def quantize(image, size=256, out=None, work=None) :
+    # Map the image range to table indices in a single affine pass (min -> 0, max -> size - 1)
+    # work is an optional float buffer of the image shape
+    # Same binning as a matplotlib colormap applied to the normalized image
+    if out is None :
+        out = np.empty(image.shape, dtype=index_dtype(size))
+    if work is None :
+        work = np.empty(image.shape, dtype=image.dtype)
+    lo, hi = minmax(image)
+    scale = size / (hi - lo) if hi > lo else 0.0
+    np.subtract(image, lo, out=work)
+    work *= scale
+    np.minimum(work, size - 1, out=work)
+    out[...] = work
+    return out
+
+def apply_lut(indices, lut, out=None) :
+    # Gather the colors of the indices, (H, W) -> (H, W, 3) uint8
+    if out is None :
+        out = np.empty(indices.shape + (3,), dtype=np.uint8)
+    return np.take(lut, indices, axis=0, out=out)
@@ -1,3 +1,8 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
 from enum import IntEnum
 
 
@@ -7,19 +12,207 @@ class Events(IntEnum) :
     PLAYER_STEP = 3
 
 
+@dataclass(frozen=True)
+class Change :
+    # Payload describing what changed : the parameter name and, for a wave parameter, its frequency label
+    param : str
+    label : int = None
+
+
+@dataclass(frozen=True)
+class BatchChange :
+    # Payload grouping the changes made during a batch update, sent as a single notification
+    changes : tuple
+
+
+def flatten_changes(payloads) :
+    # Iterate over the Change payloads, batches are expanded
+    for payload in payloads :
+        if isinstance(payload, BatchChange) :
+            yield from flatten_changes(payload.changes)
+        else :
+            yield payload
+
+
+class ChangeBatcher :
+    # Forwards changes to the callback, or buffers them while a batch is open
+    # and forwards them as a single payload when the outermost batch commits
+    def __init__(self, callback) :
+        self.callback = callback
+        self.depth = 0
+        self.changes = []
+
+    def notify(self, change) :
+        if self.depth > 0 :
+            self.changes.append(change)
+        else :
+            self.callback(change)
+
+    @contextmanager
+    def batch(self) :
+        self.depth += 1
+        try :
+            yield
+        finally :
+            self.depth -= 1
+            if self.depth == 0 and len(self.changes) > 0 :
+                # Same change repeated in the batch is only sent once
+                changes, self.changes = list(dict.fromkeys(self.changes)), []
+                self.callback(changes[0] if len(changes) == 1 else BatchChange(tuple(changes)))
+
+
 class EventBus :
-    # Simple event bus class, no payload in the publish, only for triggering callbacks
-    def __init__(self) :
+    # Simple event bus class, publish triggers the callbacks with an optional payload
+    # Handlers subscribed with with_payload=True receive the list of payloads published since their last call,
+    # the other ones are called without argument
+    # Without scheduler, publish calls the handlers synchronously
+    # With a scheduler (any object with after / after_idle, e.g. a Tk widget), publish only marks the event
+    # as pending : every pending event is dispatched once at the next idle cycle, or at most once per
+    # frame_budget milliseconds if a budget is given
+    def __init__(self, scheduler=None, frame_budget=None) :
         self.subscribers = {}
 
-    def subscribe(self, event, handler) :
+        self.scheduler = scheduler
+        self.frame_budget = frame_budget
+        self.pending = {}
+        # perf_counter time of the first publish of each pending event, and of the event being dispatched
+        self.pending_time = {}
+        self.dispatch_time = None
+        self.flush_scheduled = False
+        self.last_flush = None
+
+        # Statistics
+        self.nb_published = {}
+        self.nb_collapsed = {}
+        self.nb_dispatched = {}
+
+    def subscribe(self, event, handler, with_payload=False) :
         if event not in self.subscribers :
             self.subscribers[event] = []
-        self.subscribers[event].append(handler)
+        self.subscribers[event].append((handler, with_payload))
+
+    def publish(self, event, payload=None) :
+        self.nb_published[event] = self.nb_published.get(event, 0) + 1
+        payloads = [] if payload is None else [payload]
+        if self.scheduler is None :
+            self.dispatch(event, payloads, time.perf_counter())
+            return
+        if event in self.pending :
+            # Already waiting for the next flush, only keep the payload
+            self.nb_collapsed[event] = self.nb_collapsed.get(event, 0) + 1
+            self.pending[event].extend(payloads)
+            return
+        self.pending[event] = payloads
+        self.pending_time[event] = time.perf_counter()
+        self.schedule_flush()
+
+    def schedule_flush(self) :
+        if self.flush_scheduled :
+            return
+        self.flush_scheduled = True
+        if self.frame_budget is None :
+            self.scheduler.after_idle(self.flush)
+        else :
+            elapsed = 0 if self.last_flush is None else (time.monotonic() - self.last_flush) * 1000
+            delay = int(max(0, self.frame_budget - elapsed))
+            self.scheduler.after(delay, self.flush)
 
-    def publish(self, event) :
-        for handler in self.subscribers.get(event, []) :
-            handler()
+    def flush(self) :
+        # Dispatch every pending event, events published by the handlers go to the next flush
+        self.flush_scheduled = False
+        self.last_flush = time.monotonic()
+        pending, self.pending = self.pending, {}
+        pending_time, self.pending_time = self.pending_time, {}
+        for event, payloads in pending.items() :
+            self.dispatch(event, payloads, pending_time.get(event))
+
+    def dispatch(self, event, payloads=(), published=None) :
+        # published : time of the first publish, handlers can read it as dispatch_time (e.g. to measure latency)
+        self.nb_dispatched[event] = self.nb_dispatched.get(event, 0) + 1
+        self.dispatch_time = published if published is not None else time.perf_counter()
+        for handler, with_payload in self.subscribers.get(event, []) :
+            if with_payload :
+                handler(list(payloads))
+            else :
+                handler()
+
+    def stats(self) :
+        return {
+            event : {
+                "published" : self.nb_published.get(event, 0),
+                "collapsed" : self.nb_collapsed.get(event, 0),
+                "dispatched" : self.nb_dispatched.get(event, 0),
+            }
+            for event in self.nb_published
+        }
+
+
+class MainLoopChannel :
+    # Bounded delivery channel from worker threads to the Tk main loop
+    # put() can be called from any thread, a single poller scheduled with scheduler.after drains the queue
+    # on the main thread and calls handler(item) there
+    # latest_wins : when the queue is full the oldest item is dropped, otherwise put() blocks until there is room
+    # busy() tells if items may still be put (e.g. a player thread is running) : the poller stops once it is
+    # False and the queue is drained, start() is called again when items are expected
+    def __init__(self, scheduler, handler, maxsize=1, latest_wins=True, poll_interval=5, busy=None) :
+        self.scheduler = scheduler
+        self.handler = handler
+        self.maxsize = maxsize
+        self.latest_wins = latest_wins
+        self.poll_interval = poll_interval
+        self.busy = busy
+
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.polling = False
+
+        # Statistics
+        self.nb_put = 0
+        self.nb_dropped = 0
+        self.nb_delivered = 0
+
+    def put(self, item) :
+        with self.condition :
+            self.nb_put += 1
+            while len(self.queue) >= self.maxsize :
+                if self.latest_wins :
+                    self.queue.popleft()
+                    self.nb_dropped += 1
+                else :
+                    self.condition.wait()
+            self.queue.append(item)
+
+    def start(self) :
+        # To call from the main thread
+        if not self.polling :
+            self.polling = True
+            self.scheduler.after(self.poll_interval, self.poll)
+
+    def stop(self) :
+        self.polling = False
+
+    def poll(self) :
+        if not self.polling :
+            return
+        with self.condition :
+            items = list(self.queue)
+            self.queue.clear()
+            self.condition.notify_all()
+        for item in items :
+            self.nb_delivered += 1
+            self.handler(item)
+        # busy is read before the queue : an item put just before the producer ended is still delivered
+        active = self.busy is None or self.busy()
+        with self.condition :
+            pending = len(self.queue) > 0
+        if active or pending :
+            self.scheduler.after(self.poll_interval, self.poll)
+        else :
+            self.polling = False
+
+    def stats(self) :
+        with self.condition :
+            return {"put" : self.nb_put, "dropped" : self.nb_dropped, "delivered" : self.nb_delivered}
 
 
 if __name__ == "__main__" :
@@ -28,4 +221,28 @@ if __name__ == "__main__" :
         print("Event called !")
     eventbus.subscribe("event", event)
     eventbus.publish("event")
-    eventbus.publish("noevent")
\ No newline at end of file
+    eventbus.publish("noevent")
+
+    # Payloads
+    def payload_event(changes) :
+        print("Changes :", changes)
+    eventbus.subscribe("payload_event", payload_event, with_payload=True)
+    eventbus.publish("payload_event", Change("phase", label=1))
+    batcher = ChangeBatcher(lambda change: eventbus.publish("payload_event", change))
+    with batcher.batch() :
+        batcher.notify(Change("phase", label=1))
+        batcher.notify(Change("angle", label=1))
+
+    # Coalescing mode : three publishes, a single call
+    from tkinter import Tk
+    root = Tk()
+    coalescing_bus = EventBus(scheduler=root)
+    coalescing_bus.subscribe("event", event)
+    coalescing_bus.subscribe("payload_event", payload_event, with_payload=True)
+    for _ in range(3) :
+        coalescing_bus.publish("event")
+    coalescing_bus.publish("payload_event", Change("phase", label=1))
+    coalescing_bus.publish("payload_event", Change("angle", label=2))
+    root.after(100, root.destroy)
+    root.mainloop()
+    print(coalescing_bus.stats())
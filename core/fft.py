@@ -0,0 +1,169 @@
+import os
+import threading
+import importlib
+import importlib.util
+import numpy as np
+
+# Optional FFT libraries are imported on first use (scipy.fft alone is a large part of the start up time)
+_modules = {}
+
+def optional_module(name) :
+    # Imported module, or None if it is not installed
+    if name not in _modules :
+        try :
+            _modules[name] = importlib.import_module(name)
+        except ImportError :
+            _modules[name] = None
+    return _modules[name]
+
+def is_installed(name) :
+    # Checked without importing the package
+    return importlib.util.find_spec(name) is not None
+
+
+def column_runs(dst, src, step) :
+    # Group a column mapping into (destination slice, source slice) pairs so it can be copied with slicing
+    runs = []
+    start = 0
+    for idx in range(1, len(dst) + 1) :
+        if idx == len(dst) or dst[idx] != dst[idx - 1] + 1 or src[idx] != src[idx - 1] + step :
+            stop = src[idx - 1] + step
+            runs.append((
+                slice(dst[start], dst[idx - 1] + 1),
+                slice(src[start], stop if stop >= 0 else None, step),
+            ))
+            start = idx
+    return runs
+
+
+class ShiftedLayout :
+    # Index maps to rebuild the fftshift-ed full spectrum of a real image from its rfft2 half
+    # The missing columns come from Hermitian symmetry : F[k1, k2] = conj(F[-k1, -k2])
+    def __init__(self, shape) :
+        nb_rows, nb_cols = shape
+        half = nb_cols // 2 + 1
+        # Shifted row i shows frequency row (i - M//2) % M
+        self.rows = (np.arange(nb_rows) - nb_rows // 2) % nb_rows
+        self.mirror_rows = (-self.rows) % nb_rows
+        # Shifted column j shows frequency column k2 = (j - N//2) % N, stored in the half if k2 < N//2 + 1
+        freq_cols = (np.arange(nb_cols) - nb_cols // 2) % nb_cols
+        direct = freq_cols < half
+        self.direct_runs = column_runs(np.nonzero(direct)[0], freq_cols[direct], 1)
+        self.mirror_runs = column_runs(np.nonzero(~direct)[0], nb_cols - freq_cols[~direct], -1)
+
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+def get_layout(shape) :
+    with _layouts_lock :
+        if shape not in _layouts :
+            _layouts[shape] = ShiftedLayout(shape)
+        return _layouts[shape]
+
+def half_to_shifted(half, shape, phase=False, out=None) :
+    # Magnitude or phase (mapped in [0, 1]) of the centered full spectrum of a real image of the given shape,
+    # rebuilt from its half spectrum (the rfft2 output, columns 0 to N//2)
+    if phase :
+        values = np.angle(half)
+        values += np.pi
+        values /= 2 * np.pi
+    else :
+        values = np.abs(half)
+    layout = get_layout(shape)
+    if out is None :
+        out = np.empty(shape, dtype=values.dtype)
+    direct = np.take(values, layout.rows, axis=0)
+    mirror = np.take(values, layout.mirror_rows, axis=0)
+    for dst, src in layout.direct_runs :
+        out[:, dst] = direct[:, src]
+    for dst, src in layout.mirror_runs :
+        if phase :
+            # Conjugate half has the opposite phase
+            np.subtract(1.0, mirror[:, src], out=out[:, dst])
+        else :
+            out[:, dst] = mirror[:, src]
+    return out
+
+
+class FFTBackend :
+    # Base backend, subclasses only have to provide rfft2
+    name = "base"
+
+    def __init__(self, workers=None) :
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.lock = threading.Lock()
+
+    def rfft2(self, image) :
+        raise NotImplementedError
+
+    def shifted_spectrum(self, image, phase=False, out=None) :
+        # Same result as fftshift(fft2(image)) but computed from the half spectrum of the real input
+        return half_to_shifted(self.rfft2(image), image.shape, phase, out)
+
+
+class NumpyFFTBackend(FFTBackend) :
+    # Always available, single threaded
+    name = "numpy"
+
+    def rfft2(self, image) :
+        return np.fft.rfft2(image)
+
+
+class ScipyFFTBackend(FFTBackend) :
+    # pocketfft with worker threads, plans are cached internally by scipy
+    name = "scipy"
+
+    def rfft2(self, image) :
+        return optional_module("scipy.fft").rfft2(image, workers=self.workers)
+
+
+class PyFFTWBackend(FFTBackend) :
+    # FFTW plans are built once per (shape, dtype) and reused with their aligned buffers
+    name = "pyfftw"
+
+    def __init__(self, workers=None) :
+        super().__init__(workers)
+        self.plans = {}
+
+    def rfft2(self, image) :
+        key = (image.shape, image.dtype)
+        with self.lock :
+            if key not in self.plans :
+                pyfftw = optional_module("pyfftw")
+                builders = optional_module("pyfftw.builders")
+                template = pyfftw.empty_aligned(image.shape, dtype=image.dtype)
+                self.plans[key] = builders.rfft2(template, threads=self.workers, planner_effort="FFTW_MEASURE")
+            plan = self.plans[key]
+            # The plan output buffer is reused, copy it out before releasing the plan
+            return plan(image).copy()
+
+
+FFT_BACKENDS = {
+    "numpy" : NumpyFFTBackend,
+    "scipy" : ScipyFFTBackend,
+    "pyfftw" : PyFFTWBackend,
+}
+
+def available_fft_backends() :
+    available = ["numpy"]
+    if is_installed("scipy") :
+        available.append("scipy")
+    if is_installed("pyfftw") :
+        available.append("pyfftw")
+    return available
+
+_default_backend = None
+
+def get_fft_backend(name=None, workers=None) :
+    # Without a name, return the shared default backend
+    # pyfftw is only used on request : planning stalls every time the number of samples changes
+    global _default_backend
+    if name is None :
+        if _default_backend is None :
+            default = "scipy" if is_installed("scipy") else "numpy"
+            _default_backend = get_fft_backend(default, workers)
+        return _default_backend
+    if name not in available_fft_backends() :
+        raise ValueError(f"FFT backend not available : {name}")
+    return FFT_BACKENDS[name](workers)
@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import threading
+from dataclasses import asdict, replace
+import numpy as np
+from core.render import Renderer
+from core.sequence import apply_step
+from core.paths import user_cache_dir
+
+# Bound of the disk space used by the stored frames, in bytes
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+
+
+def default_cache_dir() :
+    # Frames are memory mapped from disk : the per user cache, not the temp directory (RAM when it is a tmpfs)
+    return user_cache_dir("frames")
+
+def evict(cache_dir, max_bytes, keep=()) :
+    # Remove the least recently used stores until the cache holds at most max_bytes, stores in keep are left
+    stores = []
+    for name in os.listdir(cache_dir) :
+        key, extension = os.path.splitext(name)
+        if extension == ".npy" and key not in keep :
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            stores.append((stat.st_mtime, stat.st_size, key))
+    total = sum(size for _, size, _ in stores)
+    for _, size, key in sorted(stores) :
+        if total <= max_bytes :
+            break
+        try :
+            # The meta file first : a store without it is never reused
+            for extension in (".json", ".npy") :
+                path = os.path.join(cache_dir, key + extension)
+                if os.path.exists(path) :
+                    os.remove(path)
+        except OSError :
+            # Still mapped by another process on some platforms, left for a later eviction
+            continue
+        total -= size
+
+def frames_key(sequence_config, params) :
+    # Identifies the frames of a sequence : its config and everything the render depends on
+    # (params is the RenderParams of the first frame, with the wave parameters before the sequence)
+    description = stringify_keys({"sequence" : sequence_config, "params" : asdict(params)})
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def stringify_keys(value) :
+    # Frequency labels are int keys, mixed with str keys they cannot be sorted by json
+    if isinstance(value, dict) :
+        return {str(k) : stringify_keys(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) :
+        return [stringify_keys(v) for v in value]
+    return value
+
+
+def frame_shape(params) :
+    height, width = params.display_shape if params.display_shape is not None else (params.nb_samples, params.nb_samples)
+    return (height, width, 3)
+
+
+class FrameStore :
+    # Rendered uint8 frames of a sequence in a memory mapped .npy file, (nb_frames, height, width, 3)
+    # Frames are written in order, nb_done frames are readable ; a complete store is reused by later sessions
+    # The cache directory is kept under max_bytes by evicting the least recently used stores
+    def __init__(self, cache_dir, key, nb_frames, frame_shape, max_bytes=DEFAULT_CACHE_SIZE) :
+        os.makedirs(cache_dir, exist_ok=True)
+        self.key = key
+        self.path = os.path.join(cache_dir, key + ".npy")
+        self.meta_path = os.path.join(cache_dir, key + ".json")
+        shape = (nb_frames,) + tuple(frame_shape)
+
+        self.nb_done = 0
+        if os.path.exists(self.path) and os.path.exists(self.meta_path) :
+            with open(self.meta_path, "r") as file :
+                meta = json.load(file)
+            if meta.get("complete") :
+                frames = np.load(self.path, mmap_mode="r")
+                if frames.shape == shape and frames.dtype == np.uint8 :
+                    self.frames = frames
+                    self.nb_done = nb_frames
+                    # Most recently used
+                    os.utime(self.path)
+                    return
+        nb_bytes = int(np.prod(shape))
+        if nb_bytes > max_bytes :
+            raise ValueError(f"{nb_bytes / 1024 ** 2:.0f} MiB of frames exceed the frame cache size ({max_bytes / 1024 ** 2:.0f} MiB)")
+        evict(cache_dir, max_bytes - nb_bytes, keep=(key,))
+        self.frames = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.uint8, shape=shape)
+
+    @property
+    def complete(self) :
+        return self.nb_done == len(self.frames)
+
+    def __len__(self) :
+        return len(self.frames)
+
+    def __getitem__(self, index) :
+        return self.frames[index]
+
+    def write(self, index, frame) :
+        self.frames[index] = frame
+        self.nb_done = index + 1
+
+    def close(self) :
+        # Release the mapping : the file can then be reopened (and truncated) safely
+        self.frames = None
+
+    def mark_complete(self) :
+        self.frames.flush()
+        with open(self.meta_path, "w") as file :
+            json.dump({"complete" : True, "shape" : list(self.frames.shape)}, file)
+
+
+class SequencePrerenderer :
+    # Renders every step of a sequence into a FrameStore on a background thread
+    # dtype and fft_backend should be those of the live renderer, so the stored frames match live playback
+    def __init__(self, sequence, params, store, dtype=np.float64, fft_backend=None) :
+        self.sequence = sequence
+        self.params = params
+        self.store = store
+        self.renderer = Renderer(dtype, fft_backend)
+        self.cancelled = False
+        self.thread = None
+
+    def start(self) :
+        if not self.store.complete :
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def cancel(self, wait=True) :
+        # With wait, return once the thread stopped writing to the store (at most one frame later)
+        self.cancelled = True
+        if wait and self.thread is not None :
+            self.thread.join()
+
+    def progress(self) :
+        return self.store.nb_done, len(self.store)
+
+    def run(self) :
+        freq_params = self.params.freq_params
+        for index, step in enumerate(self.sequence) :
+            if self.cancelled :
+                return
+            # Steps are applied one after the other, as the player does on the editor
+            freq_params = apply_step(freq_params, step)
+            frame = self.renderer.render(replace(self.params, freq_params=freq_params))
+            self.store.write(index, frame)
+        self.store.mark_complete()
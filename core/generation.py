@@ -1,28 +1,166 @@
 import numpy as np
+from core.fft import get_fft_backend, half_to_shifted
 
-def generate_wave(freq_params, length, nb_samples) :
-    # Hepler functions 
-    deg2rad = lambda deg : np.pi * deg / 180.0
-    # Generate wave
+# Hepler functions
+deg2rad = lambda deg : np.pi * deg / 180.0
+
+# Default bound of the work memory of the batched synthesis (factors and temporaries, not the image), in bytes
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+# Order of the columns of packed parameters
+PACKED_PARAMS = ("frequency", "amplitude", "phase", "angle")
+
+def component_terms(params) :
+    # Convert the parameters of one wave into its spatial pulsations along x and y and its phase (radians)
+    # Also works on packed parameters : every value is then an array with one entry per wave
+    freq = params["frequency"]
+    angle = deg2rad(params["angle"])
+    amplitude = params["amplitude"]
+    phase = deg2rad(params["phase"]) + 0.001
+    kx = 2 * np.pi * freq * np.cos(angle)
+    ky = 2 * np.pi * freq * np.sin(angle)
+    return amplitude, kx, ky, phase
+
+def pack_params(freq_params) :
+    # Parameters of every wave as arrays, {param : (K,) array} in the order of freq_params
+    values = np.array([[params[param] for param in PACKED_PARAMS] for params in freq_params.values()], dtype=float).reshape(-1, len(PACKED_PARAMS))
+    return {param : values[:, idx] for idx, param in enumerate(PACKED_PARAMS)}
+
+def generate_wave(freq_params, length, nb_samples, method="batched", memory_budget=DEFAULT_MEMORY_BUDGET) :
+    if method == "meshgrid" :
+        return generate_wave_meshgrid(freq_params, length, nb_samples)
+    elif method == "separable" :
+        return generate_wave_separable(freq_params, length, nb_samples)
+    elif method == "batched" :
+        x = np.linspace(0, length, nb_samples)
+        return synthesize_batched(pack_params(freq_params), x, np.empty((nb_samples, nb_samples)), memory_budget=memory_budget)
+    raise ValueError(f"Unknown generation method : {method}")
+
+def generate_wave_meshgrid(freq_params, length, nb_samples) :
+    # Reference implementation, evaluates sin over the full grid for every wave
     x = np.linspace(0, length, nb_samples)
     X, Y = np.meshgrid(x, x)
     image = np.zeros_like(X)
     for params in freq_params.values() :
-        freq = params["frequency"]
-        angle = params["angle"]
-        amplitude = params["amplitude"]
-        phase = params["phase"]
-        angle = deg2rad(angle)
-        phase = deg2rad(phase) + 0.001
-        image += amplitude * np.sin(2 * np.pi * freq * (np.cos(angle) * X + np.sin(angle) * Y) + phase)
+        amplitude, kx, ky, phase = component_terms(params)
+        image += amplitude * np.sin(kx * X + ky * Y + phase)
     return image
 
-def apply_fourier_transform(image, phase=False) :
-    transform = np.fft.fft2(image)
-    shifted_transorm = np.fft.fftshift(transform)
-    if not phase :
-        image = np.abs(shifted_transorm)
-    else :
-        image = np.angle(shifted_transorm)
-        image = (image + np.pi) / (2 * np.pi)
-    return image
\ No newline at end of file
+def generate_wave_separable(freq_params, length, nb_samples) :
+    x = np.linspace(0, length, nb_samples)
+    image = np.empty((nb_samples, nb_samples))
+    return synthesize_separable(freq_params, x, image)
+
+def wave_factors(params, x, rows, cols, y=None) :
+    # Fill rows (N, 2) with [cos(ky.y), sin(ky.y)] and cols (2, N) with [sin(kx.x + phase), cos(kx.x + phase)]
+    # so that amplitude * rows @ cols is the wave (rows indexed by y, columns by x, same layout as np.meshgrid)
+    # y defaults to x (square grid), 1D factors are evaluated in the precision of x then stored in the buffers dtype
+    amplitude, kx, ky, phase = component_terms(params)
+    arg_y = ky * (x if y is None else y)
+    np.cos(arg_y, out=rows[:, 0])
+    np.sin(arg_y, out=rows[:, 1])
+    arg_x = kx * x + phase
+    np.sin(arg_x, out=cols[0])
+    np.cos(arg_x, out=cols[1])
+    return amplitude
+
+def synthesize_separable(freq_params, x, out, rows=None, cols=None, layer=None) :
+    # sin(kx.x + ky.y + phase) = cos(ky.y) sin(kx.x + phase) + sin(ky.y) cos(kx.x + phase)
+    # so every wave is a rank 2 outer product of 1D vectors : only O(N) sin/cos evaluations per wave
+    # The image is accumulated in out, rows, cols and layer are optional work buffers of shape (N, 2), (2, N) and (N, N)
+    nb_samples = len(x)
+    if rows is None :
+        rows = np.empty((nb_samples, 2), dtype=out.dtype)
+    if cols is None :
+        cols = np.empty((2, nb_samples), dtype=out.dtype)
+    out.fill(0)
+    for params in freq_params.values() :
+        amplitude = wave_factors(params, x, rows, cols)
+        rows *= amplitude
+        if layer is None :
+            out += rows @ cols
+        else :
+            np.matmul(rows, cols, out=layer)
+            out += layer
+    return out
+
+def batch_factors(terms, x, y=None, dtype=np.float64) :
+    # 1D factors of K waves at once, terms is the (amplitude, kx, ky, phase) arrays of component_terms
+    # rows (H, 2K) and cols (2K, W) hold the factors of wave k in columns / rows 2k and 2k + 1 (same as wave_factors)
+    # so that (rows * amplitude) @ cols is the sum of the waves, and rows[:, 2k:2k + 2] @ cols[2k:2k + 2] is wave k
+    _, kx, ky, phase = terms
+    y = x if y is None else y
+    nb_waves = len(kx)
+    rows = np.empty((len(y), 2 * nb_waves), dtype=dtype)
+    cols = np.empty((2 * nb_waves, len(x)), dtype=dtype)
+    arg_y = np.multiply.outer(y, ky)
+    np.cos(arg_y, out=rows[:, 0::2])
+    np.sin(arg_y, out=rows[:, 1::2])
+    arg_x = np.multiply.outer(kx, x)
+    arg_x += phase[:, None]
+    np.sin(arg_x, out=cols[0::2])
+    np.cos(arg_x, out=cols[1::2])
+    return rows, cols
+
+def waves_per_chunk(height, width, dtype, memory_budget=DEFAULT_MEMORY_BUDGET) :
+    # Number of waves whose factors and temporaries fit in memory_budget bytes (at least one) :
+    # per wave, the double precision arguments (H + W) plus the rows, scaled rows and cols (2H + 2H + 2W)
+    itemsize = np.dtype(dtype).itemsize
+    per_wave = (height + width) * 8 + (4 * height + 2 * width) * itemsize
+    return max(1, int(memory_budget // per_wave))
+
+def synthesize_batched(packed, x, out, y=None, memory_budget=DEFAULT_MEMORY_BUDGET, work=None) :
+    # Sum of the waves of packed parameters (see pack_params) with batched array operations, no Python loop over the waves
+    # Waves are processed by chunks so the work memory stays under memory_budget, each chunk is one (H, 2k) @ (2k, W) product
+    # work is an optional buffer of the image shape, only used when there is more than one chunk
+    terms = component_terms(packed)
+    nb_waves = len(terms[0])
+    if nb_waves == 0 :
+        out.fill(0)
+        return out
+    chunk = waves_per_chunk(out.shape[0], out.shape[1], out.dtype, memory_budget)
+    for start in range(0, nb_waves, chunk) :
+        stop = min(start + chunk, nb_waves)
+        chunk_terms = tuple(term[start:stop] for term in terms)
+        rows, cols = batch_factors(chunk_terms, x, y, out.dtype)
+        rows[:, 0::2] *= chunk_terms[0]
+        rows[:, 1::2] *= chunk_terms[0]
+        if start == 0 :
+            np.matmul(rows, cols, out=out)
+        else :
+            if work is None :
+                work = np.empty_like(out)
+            np.matmul(rows, cols, out=work)
+            out += work
+    return out
+
+def apply_fourier_transform(image, phase=False, backend=None, out=None) :
+    # Centered magnitude, or phase mapped in [0, 1], of the 2D spectrum
+    # The image is real so only the half spectrum is computed, the other half comes from symmetry
+    if backend is None :
+        backend = get_fft_backend()
+    elif isinstance(backend, str) :
+        backend = get_fft_backend(backend)
+    return backend.shifted_spectrum(image, phase, out=out)
+
+def spectrum_from_params(freq_params, length, nb_samples, phase=False, out=None) :
+    # Same display as apply_fourier_transform(generate_wave(...)) without forming the image or a 2D FFT
+    # Sampled on x_n = n.d, a wave is A/2i (e^i(phase) e^i(wx.n) e^i(wy.m) - e^-i(phase) e^-i(wx.n) e^-i(wy.m))
+    # so its 2D DFT is a sum of two outer products of the 1D DFTs of e^(+-i.w.n) (leakage included)
+    n = np.arange(nb_samples)
+    step = length / (nb_samples - 1) if nb_samples > 1 else 0.0
+    amplitude, kx, ky, phi = component_terms(pack_params(freq_params))
+    dft_x = np.fft.fft(np.exp(1j * np.outer(kx * step, n)), axis=1)
+    dft_y = np.fft.fft(np.exp(1j * np.outer(ky * step, n)), axis=1)
+    # DFT of the conjugate signal : conj(D[-k])
+    mirror = (-n) % nb_samples
+    dft_x_neg = np.conj(dft_x[:, mirror])
+    dft_y_neg = np.conj(dft_y[:, mirror])
+    # Rows indexed by the y frequency, only the half of the x frequencies is needed (real image)
+    half = nb_samples // 2 + 1
+    left = np.concatenate([
+        (amplitude * np.exp(1j * phi) / 2j)[:, None] * dft_y,
+        (-amplitude * np.exp(-1j * phi) / 2j)[:, None] * dft_y_neg,
+    ]).T
+    right = np.concatenate([dft_x[:, :half], dft_x_neg[:, :half]])
+    return half_to_shifted(left @ right, (nb_samples, nb_samples), phase, out)
@@ -0,0 +1,112 @@
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+
+# Histogram bin edges in ms, log spaced from 0.01 ms to 10 s
+HISTOGRAM_EDGES = np.logspace(-2, 4, 25)
+
+# Order of the timings in the summary and the overlay
+TIMINGS = ("synthesis", "fourier", "normalize", "colormap", "blit", "latency", "player_lag")
+
+
+class Instrumentation :
+    # Rolling record of the render pipeline timings, shared by the render thread, the main loop and the player
+    #   - record(name, seconds) keeps the last `window` durations of a timing (stage, latency, lag...)
+    #   - mark(name) keeps the last `window` times of an event, to compute its rate (renders per second)
+    # Disabled instrumentation is None : every hook is a single `is not None` test
+    def __init__(self, window=256) :
+        self.window = window
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.marks = {}
+        self.start_time = time.perf_counter()
+
+    def record(self, name, duration) :
+        with self.lock :
+            if name not in self.durations :
+                self.durations[name] = deque(maxlen=self.window)
+            self.durations[name].append(duration)
+
+    def lap(self, name, start) :
+        # Record the time since start and return now, to chain the stages of a pipeline
+        now = time.perf_counter()
+        self.record(name, now - start)
+        return now
+
+    def mark(self, name, when=None) :
+        with self.lock :
+            if name not in self.marks :
+                self.marks[name] = deque(maxlen=self.window)
+            self.marks[name].append(time.perf_counter() if when is None else when)
+
+    def reset(self) :
+        with self.lock :
+            self.durations.clear()
+            self.marks.clear()
+            self.start_time = time.perf_counter()
+
+    def values(self, name) :
+        # Durations of a timing in ms, oldest first
+        with self.lock :
+            return np.array(self.durations.get(name, ()), dtype=float) * 1000
+
+    def rate(self, name, horizon=2.0) :
+        # Events per second over the last horizon seconds
+        with self.lock :
+            marks = list(self.marks.get(name, ()))
+        now = time.perf_counter()
+        recent = [mark for mark in marks if now - mark <= horizon]
+        if len(recent) == 0 :
+            return 0.0
+        return len(recent) / min(horizon, now - self.start_time)
+
+    def histogram(self, name, edges=HISTOGRAM_EDGES) :
+        # Counts of the durations (ms) in the bins [edges[i], edges[i + 1][, values outside are clipped to the ends
+        values = np.clip(self.values(name), edges[0], edges[-1])
+        counts, _ = np.histogram(values, bins=edges)
+        return counts
+
+    def summary(self) :
+        timings = {}
+        with self.lock :
+            names = list(self.durations)
+            marks = list(self.marks)
+        for name in sorted(names, key=lambda name : (TIMINGS.index(name) if name in TIMINGS else len(TIMINGS), name)) :
+            values = self.values(name)
+            if len(values) == 0 :
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            timings[name] = {
+                "count" : len(values),
+                "mean_ms" : float(values.mean()),
+                "p50_ms" : float(p50),
+                "p95_ms" : float(p95),
+                "p99_ms" : float(p99),
+                "max_ms" : float(values.max()),
+                "last_ms" : float(values[-1]),
+                "histogram" : self.histogram(name).tolist(),
+            }
+        return {
+            "window" : self.window,
+            "histogram_edges_ms" : HISTOGRAM_EDGES.tolist(),
+            "rates" : {name : self.rate(name) for name in marks},
+            "timings" : timings,
+        }
+
+    def dump(self, filename=None) :
+        # Machine readable summary, written to filename if given
+        text = json.dumps(self.summary(), indent=1)
+        if filename is not None :
+            with open(filename, "w") as file :
+                file.write(text)
+        return text
+
+    def format_overlay(self) :
+        # Short text for the canvas overlay
+        summary = self.summary()
+        lines = [" | ".join(f"{name} {rate:.1f}/s" for name, rate in summary["rates"].items())]
+        for name, timing in summary["timings"].items() :
+            lines.append(f"{name:<10} {timing['p50_ms']:7.2f} ms  p95 {timing['p95_ms']:7.2f} ms")
+        return "\n".join(lines)
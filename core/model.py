@@ -1,4 +1,5 @@
 import json
+from core.events import Change
 
 def load_frequencies_dict( filename) :
     with open(filename, "r") as file :
@@ -13,4 +14,70 @@ def save_frequencies_dict(filename, freq_params) :
     with open(filename, "w") as file :
         json.dump(freq_params_convert, file)
         file.close()
-    
\ No newline at end of file
+    
+
+# Parameters of a new wave
+DEFAULT_WAVE_PARAMS = {"frequency" : 1.0, "amplitude" : 1.0, "phase" : 0.0, "angle" : 0.0}
+
+
+class FrequencyModel :
+    # Wave parameters by frequency label, held in plain dictionnaries
+    # The editor widgets only display and edit it, renders read it without touching Tk
+    # callback receives a core.events.Change for every modification : (param, label) for a value,
+    # "frequencies" when waves are added, deleted or loaded
+    def __init__(self, freq_params=None, callback=None) :
+        self.callback = callback
+        self.params = {}
+        self.labels = []
+        self.replace(freq_params if freq_params is not None else {1 : dict(DEFAULT_WAVE_PARAMS)}, notify=False)
+
+    def notify(self, param, label=None) :
+        if self.callback :
+            self.callback(Change(param, label))
+
+    def __len__(self) :
+        return len(self.labels)
+
+    def __contains__(self, label) :
+        return label in self.params
+
+    def replace(self, freq_params, notify=True) :
+        # Every wave at once, e.g. a loaded file
+        self.params = {label : {**DEFAULT_WAVE_PARAMS, **params} for label, params in freq_params.items()}
+        self.labels = sorted(self.params)
+        if notify :
+            self.notify("frequencies")
+
+    def add(self, params=None) :
+        label = max(self.labels) + 1 if len(self.labels) > 0 else 1
+        self.params[label] = {**DEFAULT_WAVE_PARAMS, **(params or {})}
+        self.labels.append(label)
+        self.notify("frequencies")
+        return label
+
+    def delete(self, label) :
+        del self.params[label]
+        self.labels.remove(label)
+        self.notify("frequencies")
+
+    def get(self, label) :
+        return dict(self.params[label])
+
+    def get_all(self) :
+        return {label : dict(self.params[label]) for label in self.labels}
+
+    def set(self, label, param, value) :
+        # Only actual changes are notified
+        if self.params[label].get(param) != value :
+            self.params[label][param] = value
+            self.notify(param, label)
+
+    def set_params(self, freq_params) :
+        # {label : {param : value}} for part of the waves, unknown labels and params are ignored,
+        # angle and phase are wrapped in [0, 360[ (same rules as core.sequence.apply_step)
+        for label, param_dict in freq_params.items() :
+            if label not in self.params :
+                continue
+            for param, value in param_dict.items() :
+                if param in self.params[label] :
+                    self.set(label, param, value % 360.0 if param in ["angle", "phase"] else value)
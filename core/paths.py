@@ -0,0 +1,15 @@
+import os
+import sys
+
+
+def user_cache_dir(*names) :
+    # Per user cache directory of the application, on disk (not the temp directory, often a RAM tmpfs) :
+    # %LOCALAPPDATA%\simplegui on Windows, ~/Library/Caches/simplegui on macOS, $XDG_CACHE_HOME/simplegui
+    # (~/.cache/simplegui by default) elsewhere
+    if sys.platform == "win32" :
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    elif sys.platform == "darwin" :
+        base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else :
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "simplegui", *names)
@@ -0,0 +1,328 @@
+import time
+from dataclasses import dataclass
+import numpy as np
+from core.generation import wave_factors, apply_fourier_transform, spectrum_from_params, pack_params, component_terms, batch_factors, synthesize_batched, DEFAULT_MEMORY_BUDGET
+from core.fft import get_fft_backend
+from core.colormap import minmax, quantize, index_dtype, get_lut, apply_lut
+
+
+def normalize_image(image, out=None) :
+    # Rescale the image in [0, 1], a flat image is mapped to 0
+    if out is None :
+        out = np.empty_like(image)
+    lo, hi = minmax(image)
+    scale = 1.0 / (hi - lo) if hi > lo else 0.0
+    np.subtract(image, lo, out=out)
+    out *= scale
+    return out
+
+
+def pixel_map(nb_samples, nb_pixels) :
+    # Sample shown by each pixel when nb_samples are stretched over nb_pixels (same as a PIL NEAREST resize)
+    return np.minimum(((np.arange(nb_pixels) + 0.5) * nb_samples / nb_pixels).astype(np.intp), nb_samples - 1)
+
+
+class WaveLayer :
+    # Cached 1D factors of one wave : its layer in the image is amplitude * rows @ cols
+    # rows (N, 2) and cols (2, N) can be given already computed (views of batch_factors arrays)
+    def __init__(self, params, x, y, dtype, rows=None, cols=None) :
+        self.geometry = (params["frequency"], params["phase"], params["angle"])
+        if rows is None :
+            self.rows = np.empty((len(y), 2), dtype=dtype)
+            self.cols = np.empty((2, len(x)), dtype=dtype)
+            self.amplitude = wave_factors(params, x, self.rows, self.cols, y)
+        else :
+            self.rows, self.cols = rows, cols
+            self.amplitude = params["amplitude"]
+
+
+class RenderContext :
+    # Holds the coordinates and the work buffers for a given (length, nb_samples)
+    # so repeated renders at the same size do not allocate
+    # The synthesized image is kept as a running sum of per-label layers, edits only touch the changed labels
+    # With a display_shape (height, width), only the samples shown on such a display are evaluated
+    # along the axes with more samples than pixels
+    # When the factors of every wave do not fit in memory_budget bytes, layers are not cached and the image
+    # is summed by chunks of waves under the same budget
+    def __init__(self, length, nb_samples, dtype=np.float64, max_delta_updates=64, display_shape=None, memory_budget=DEFAULT_MEMORY_BUDGET) :
+        self.length = length
+        self.memory_budget = memory_budget
+        self.nb_samples = nb_samples
+        self.dtype = np.dtype(dtype)
+        self.display_shape = display_shape
+
+        # Coordinates are kept in double precision, only the buffers use the selected dtype
+        x = np.linspace(0, length, nb_samples)
+        self.x, self.y = x, x
+        if display_shape is not None :
+            height, width = display_shape
+            if nb_samples > height :
+                self.y = x[pixel_map(nb_samples, height)]
+            if nb_samples > width :
+                self.x = x[pixel_map(nb_samples, width)]
+
+        shape = (len(self.y), len(self.x))
+        self.image = np.empty(shape, dtype=self.dtype)
+        self.normalized = np.empty(shape, dtype=self.dtype)
+        # Only needed by the Fourier views, allocated on first use
+        self.spectrum = None
+        self.layer = np.empty(shape, dtype=self.dtype)
+        # Colormap indices, allocated on first use (their dtype depends on the table size)
+        self.indices = None
+
+        # Layers currently summed in self.image, by frequency label
+        self.layers = None
+        # Delta updates accumulate rounding errors, rebuild the sum from the factors after too many of them
+        self.max_delta_updates = max_delta_updates
+        self.nb_delta_updates = 0
+
+    @property
+    def key(self) :
+        return (self.length, self.nb_samples, self.dtype, self.display_shape)
+
+    def matches(self, length, nb_samples, dtype=None, display_shape=None) :
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        return self.key == (length, nb_samples, dtype, display_shape)
+
+    def generate(self, freq_params) :
+        if self.layers is None or self.nb_delta_updates >= self.max_delta_updates :
+            return self.rebuild(freq_params)
+
+        # Collect the rank 2 terms to add (positive amplitude) and to remove (negative amplitude)
+        terms = []
+        new_layers = {}
+        fresh = []
+        for label, params in freq_params.items() :
+            old = self.layers.get(label)
+            geometry = (params["frequency"], params["phase"], params["angle"])
+            if old is not None and old.geometry == geometry :
+                new_layers[label] = old
+                if params["amplitude"] != old.amplitude :
+                    # Amplitude only edit : scaled add of the same layer
+                    terms.append((params["amplitude"] - old.amplitude, old))
+                    old.amplitude = params["amplitude"]
+                continue
+            fresh.append(label)
+            if old is not None :
+                terms.append((-old.amplitude, old))
+        for label, layer in self.make_layers(freq_params, fresh).items() :
+            new_layers[label] = layer
+            terms.append((layer.amplitude, layer))
+        for label, old in self.layers.items() :
+            if label not in freq_params :
+                terms.append((-old.amplitude, old))
+        self.layers = new_layers
+
+        if len(terms) == 0 :
+            return self.image
+        # Touching most of the waves, a full sum is as cheap and has no drift
+        if len(terms) > len(new_layers) :
+            return self.rebuild(freq_params)
+        self.nb_delta_updates += 1
+        rows = np.concatenate([amplitude * layer.rows for amplitude, layer in terms], axis=1)
+        cols = np.concatenate([layer.cols for _, layer in terms], axis=0)
+        np.matmul(rows, cols, out=self.layer)
+        self.image += self.layer
+        return self.image
+
+    def make_layers(self, freq_params, labels) :
+        # Layers of the given labels, their factors are computed in one batch
+        if len(labels) == 0 :
+            return {}
+        packed = pack_params({label : freq_params[label] for label in labels})
+        rows, cols = batch_factors(component_terms(packed), self.x, self.y, self.dtype)
+        return {
+            label : WaveLayer(freq_params[label], self.x, self.y, self.dtype, rows[:, 2 * idx:2 * idx + 2], cols[2 * idx:2 * idx + 2])
+            for idx, label in enumerate(labels)
+        }
+
+    def cache_size(self, nb_waves) :
+        # Bytes taken by the cached factors of nb_waves layers
+        return nb_waves * 2 * (len(self.x) + len(self.y)) * self.dtype.itemsize
+
+    def rebuild(self, freq_params) :
+        # Sum every layer from scratch in a single (H, 2K) @ (2K, W) product
+        self.nb_delta_updates = 0
+        if self.cache_size(len(freq_params)) > self.memory_budget :
+            # Too many waves to keep their factors : no layers, summed by chunks under the memory budget
+            self.layers = None
+            return synthesize_batched(pack_params(freq_params), self.x, self.image, self.y, self.memory_budget, work=self.layer)
+        layers = self.layers or {}
+        new_layers = {}
+        fresh = []
+        for label, params in freq_params.items() :
+            old = layers.get(label)
+            if old is not None and old.geometry == (params["frequency"], params["phase"], params["angle"]) :
+                old.amplitude = params["amplitude"]
+                new_layers[label] = old
+            else :
+                new_layers[label] = None
+                fresh.append(label)
+        new_layers.update(self.make_layers(freq_params, fresh))
+        self.layers = new_layers
+        if len(new_layers) == 0 :
+            self.image.fill(0)
+            return self.image
+        amplitudes = np.repeat([layer.amplitude for layer in new_layers.values()], 2)
+        rows = np.concatenate([layer.rows for layer in new_layers.values()], axis=1)
+        rows *= amplitudes
+        cols = np.concatenate([layer.cols for layer in new_layers.values()], axis=0)
+        np.matmul(rows, cols, out=self.image)
+        return self.image
+
+    def get_spectrum_buffer(self) :
+        if self.spectrum is None :
+            self.spectrum = np.empty(self.image.shape, dtype=self.dtype)
+        return self.spectrum
+
+    def fourier(self, image=None, phase=False, backend=None) :
+        if image is None :
+            image = self.image
+        return apply_fourier_transform(image, phase, backend=backend, out=self.get_spectrum_buffer())
+
+    def fourier_from_params(self, freq_params, phase=False) :
+        return spectrum_from_params(freq_params, self.length, self.nb_samples, phase, out=self.get_spectrum_buffer())
+
+    def normalize(self, image=None) :
+        if image is None :
+            image = self.image
+        return normalize_image(image, out=self.normalized)
+
+    def quantize(self, image=None, size=256) :
+        # Normalize and quantize to colormap table indices in one pass
+        if image is None :
+            image = self.image
+        if self.indices is None or self.indices.dtype != index_dtype(size) :
+            self.indices = np.empty(image.shape, dtype=index_dtype(size))
+        return quantize(image, size, out=self.indices, work=self.normalized)
+
+
+@dataclass
+class RenderParams :
+    # Snapshot of everything a render depends on
+    freq_params : dict
+    length : float
+    nb_samples : int
+    fourier : bool = False
+    phase : bool = False
+    direct_spectrum : bool = False
+    cmap : str = "gray"
+    # (height, width) of the frame to produce, None for one pixel per sample
+    display_shape : tuple = None
+
+
+class RenderCancelled(Exception) :
+    pass
+
+
+class Renderer :
+    # Headless render pipeline : RenderParams -> uint8 RGB frame
+    # Only the stages after the first one affected by the parameter changes are rerun
+    # The returned frame is a new array owned by the caller (it can be handed to another thread)
+    STAGES = ("synthesis", "fourier", "normalize", "colormap")
+
+    def __init__(self, dtype=np.float64, fft_backend=None, lut_size=256, instrumentation=None, memory_budget=DEFAULT_MEMORY_BUDGET, max_contexts=2) :
+        self.dtype = np.dtype(dtype)
+        self.lut_size = lut_size
+        # Bound of the synthesis work memory, in bytes (see RenderContext)
+        self.memory_budget = memory_budget
+        # Optional core.instrumentation.Instrumentation receiving the time of each stage
+        self.instrumentation = instrumentation
+        self.fft_backend = get_fft_backend(fft_backend) if fft_backend is None or isinstance(fft_backend, str) else fft_backend
+        self.context = None
+        # Contexts of the last sizes rendered, most recent last : alternating sizes (e.g. a coarse preview
+        # and the full resolution) keeps the wave layers of each size
+        self.contexts = []
+        self.max_contexts = max_contexts
+        self.last = None
+        self.dirty = set(self.STAGES)
+        self.image = None
+        self.indices = None
+        self.frame = None
+
+    def invalidate(self, stage="synthesis") :
+        self.dirty.update(self.STAGES[self.STAGES.index(stage):])
+
+    def get_context(self, length, nb_samples, display_shape=None) :
+        for context in self.contexts :
+            if context.matches(length, nb_samples, self.dtype, display_shape) :
+                self.contexts.remove(context)
+                break
+        else :
+            context = RenderContext(length, nb_samples, self.dtype, display_shape=display_shape, memory_budget=self.memory_budget)
+        context.memory_budget = self.memory_budget
+        self.contexts.append(context)
+        del self.contexts[:-self.max_contexts]
+        return context
+
+    def update_dirty(self, params) :
+        # Compare with the parameters of the previous render
+        last = self.last
+        # Samples the display cannot show are skipped, except for the Fourier views that need the whole image
+        sampled_shape = None if params.fourier else params.display_shape
+        context = self.get_context(params.length, params.nb_samples, sampled_shape)
+        if context is not self.context or last is None :
+            self.context = context
+            self.invalidate("synthesis")
+        elif params.freq_params != last.freq_params :
+            self.invalidate("synthesis")
+        elif (params.fourier, params.phase, params.direct_spectrum) != (last.fourier, last.phase, last.direct_spectrum) :
+            self.invalidate("fourier")
+        elif params.cmap != last.cmap or params.display_shape != last.display_shape :
+            self.invalidate("colormap")
+        self.last = params
+
+    def render(self, params, cancelled=None) :
+        # cancelled is an optional function checked between stages, RenderCancelled is raised when it returns True
+        def check() :
+            if cancelled is not None and cancelled() :
+                # Stages not finished stay dirty for the next render
+                raise RenderCancelled()
+
+        timer = self.instrumentation
+        if timer is not None :
+            start = time.perf_counter()
+        self.update_dirty(params)
+        context = self.context
+        # Spectrum computed directly from the parameters, no image and no 2D FFT
+        direct = params.fourier and params.direct_spectrum
+        # Generate wave (not needed for the direct spectrum, the stage then stays dirty)
+        if "synthesis" in self.dirty and not direct :
+            context.generate(params.freq_params)
+            self.dirty.discard("synthesis")
+            if timer is not None :
+                start = timer.lap("synthesis", start)
+            check()
+        # Fourier transform
+        if "fourier" in self.dirty :
+            if direct :
+                self.image = context.fourier_from_params(params.freq_params, params.phase)
+            elif params.fourier :
+                self.image = context.fourier(context.image, params.phase, backend=self.fft_backend)
+            else :
+                self.image = context.image
+            self.dirty.discard("fourier")
+            if timer is not None :
+                start = timer.lap("fourier", start)
+            check()
+        # Normalize image straight into colormap indices (in the context buffer, kept for colormap changes)
+        if "normalize" in self.dirty :
+            self.indices = context.quantize(self.image, self.lut_size)
+            self.dirty.discard("normalize")
+            if timer is not None :
+                start = timer.lap("normalize", start)
+            check()
+        # Apply cmap, precomputed uint8 table lookup, at the display resolution
+        if "colormap" in self.dirty :
+            indices = self.indices
+            if params.display_shape is not None :
+                height, width = params.display_shape
+                if indices.shape[0] != height :
+                    indices = np.take(indices, pixel_map(indices.shape[0], height), axis=0)
+                if indices.shape[1] != width :
+                    indices = np.take(indices, pixel_map(indices.shape[1], width), axis=1)
+            self.frame = apply_lut(indices, get_lut(params.cmap, self.lut_size))
+            self.dirty.discard("colormap")
+            if timer is not None :
+                timer.lap("colormap", start)
+        return self.frame
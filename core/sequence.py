@@ -3,6 +3,82 @@ import threading
 import json
 import numpy as np
 
+# Canonical order of the parameters axis
+SEQUENCE_PARAMS = ["frequency", "amplitude", "phase", "angle"]
+
+
+class SequenceStep :
+    # Lightweight read only view of one step, behaves like the {label: {param: value}} dictionnary
+    # values can be given for steps evaluated on demand (KeyframeSequence)
+    def __init__(self, sequence, index, values=None) :
+        self.sequence = sequence
+        self.index = index
+        self._values = values
+
+    @property
+    def values(self) :
+        # (components, params) array of the step, NaN for the params not in the sequence
+        return self.sequence.values[self.index] if self._values is None else self._values
+
+    def __getitem__(self, label) :
+        row = self.values[self.sequence.label_index[label]]
+        return {param : float(row[idx]) for param, idx in self.sequence.present[label]}
+
+    def __contains__(self, label) :
+        return label in self.sequence.label_index
+
+    def __iter__(self) :
+        return iter(self.sequence.labels)
+
+    def __len__(self) :
+        return len(self.sequence.labels)
+
+    def keys(self) :
+        return list(self.sequence.labels)
+
+    def items(self) :
+        return [(label, self[label]) for label in self.sequence.labels]
+
+    def to_dict(self) :
+        return dict(self.items())
+
+    def __repr__(self) :
+        return repr(self.to_dict())
+
+
+class Sequence :
+    # Interpolated sequence stored column wise : values is a (steps, components, params) array,
+    # components follow labels and params follow params, NaN where a component has no track for a param
+    def __init__(self, values, labels, params, timestep) :
+        self.values = values
+        self.labels = list(labels)
+        self.params = list(params)
+        self.timestep = timestep
+        self.label_index = {label : idx for idx, label in enumerate(self.labels)}
+        # Sequenced params of each label, as (param, column index)
+        self.present = {}
+        for label, idx in self.label_index.items() :
+            sequenced = ~np.isnan(values[0, idx]) if len(values) > 0 else np.zeros(len(self.params), dtype=bool)
+            self.present[label] = [(param, p_idx) for p_idx, param in enumerate(self.params) if sequenced[p_idx]]
+
+    def __len__(self) :
+        return len(self.values)
+
+    def __getitem__(self, index) :
+        if index < 0 :
+            index += len(self)
+        if not 0 <= index < len(self) :
+            raise IndexError("Sequence index out of range")
+        return SequenceStep(self, index)
+
+    def __iter__(self) :
+        for index in range(len(self)) :
+            yield SequenceStep(self, index)
+
+    def track(self, label, param) :
+        # Values of one parameter over the whole sequence
+        return self.values[:, self.label_index[label], self.params.index(param)]
+
 def load_sequence_config(filename) :
     with open(filename, "r") as file :
         sequence_config = json.load(file)
@@ -12,102 +88,389 @@ def load_sequence_config(filename) :
     sequence_config_convert["timestep"] = sequence_config["timestep"]
     return sequence_config_convert
 
+class TrackIndex :
+    # Keypoints of every track sorted once, memory is proportional to the keypoints
+    # tracks is a list of (keypoint times, keypoint values), values are held before the first and after the last keypoint
+    #   - a time grid (a whole sequence) is evaluated track by track with np.interp, a linear merge of two sorted arrays
+    #   - a few times (one step) are evaluated with a binary search of every track at once : O(log keys) per track
+    # Number of times up to which the binary search is used
+    FEW_TIMES = 64
+
+    def __init__(self, tracks) :
+        self.tracks = []
+        for track_times, track_values in tracks :
+            order = np.argsort(track_times, kind="stable")
+            track_times = np.asarray(track_times, dtype=float)[order]
+            track_values = np.asarray(track_values, dtype=float)[order]
+            if len(track_times) == 1 :
+                # A single keypoint is a constant segment
+                track_times = np.append(track_times, track_times[0] + 1.0)
+                track_values = np.append(track_values, track_values[0])
+            self.tracks.append((track_times, track_values))
+        self.t_min = min(float(track_times[0]) for track_times, _ in self.tracks)
+        self.t_max = max(float(track_times[-1]) for track_times, _ in self.tracks)
+        # Concatenated keypoints for the binary search, built at the first search (make_sequence never needs them)
+        self.key_times = None
+        self.key_values = None
+
+    def __len__(self) :
+        return len(self.tracks)
+
+    def evaluate(self, times) :
+        # Linear interpolation of every track at every time, returns (times, tracks)
+        times = np.clip(np.atleast_1d(np.asarray(times, dtype=float)), self.t_min, self.t_max)
+        if times.size <= self.FEW_TIMES :
+            return self.evaluate_few(times)
+        values = np.empty((len(self.tracks), times.size))
+        for track_idx, (track_times, track_values) in enumerate(self.tracks) :
+            values[track_idx] = np.interp(times, track_times, track_values)
+        return values.T
+
+    def build_search(self) :
+        # Track j is key_times[starts[j]:ends[j] + 1], the keypoint times themselves are not shifted
+        lengths = np.array([len(track_times) for track_times, _ in self.tracks])
+        self.ends = (np.cumsum(lengths) - 1)[:, None]
+        self.starts = self.ends - lengths[:, None] + 1
+        self.key_times = np.concatenate([track_times for track_times, _ in self.tracks])
+        self.key_values = np.concatenate([track_values for _, track_values in self.tracks])
+
+    def evaluate_few(self, times) :
+        if self.key_times is None :
+            self.build_search()
+        # First keypoint after each time in each track, (tracks, times) : lanes are halved together until lo == hi
+        lo = np.repeat(self.starts, times.size, axis=1)
+        hi = np.repeat(self.ends + 1, times.size, axis=1)
+        active = lo < hi
+        while active.any() :
+            mid = np.minimum((lo + hi) // 2, len(self.key_times) - 1)
+            after = self.key_times[mid] > times[None, :]
+            hi = np.where(active & after, mid, hi)
+            lo = np.where(active & ~after, mid + 1, lo)
+            active = lo < hi
+        left = np.clip(lo - 1, self.starts, self.ends - 1)
+        t1, t2 = self.key_times[left], self.key_times[left + 1]
+        v1, v2 = self.key_values[left], self.key_values[left + 1]
+        duration = t2 - t1
+        # A zero duration segment (repeated keypoint time) jumps to its second value at that time
+        weight = (times[None, :] >= t2).astype(float)
+        weight = np.clip(np.divide(times[None, :] - t1, duration, out=weight, where=duration > 0), 0.0, 1.0)
+        return (v1 + weight * (v2 - v1)).T
+
+def sequence_tracks(sequence_config) :
+    # Every track (one wave parameter) of a config without its timestep :
+    # labels, params (canonical order), tracks as (times, values) and their (label index, param index)
+    labels = list(sequence_config.keys())
+    all_params = {param for config in sequence_config.values() for param in config}
+    params = [param for param in SEQUENCE_PARAMS if param in all_params] + sorted(all_params - set(SEQUENCE_PARAMS))
+    tracks, positions = [], []
+    for label_idx, config in enumerate(sequence_config.values()) :
+        for param, keypoints in config.items() :
+            tracks.append((
+                [keypoint["time"] for keypoint in keypoints],
+                [keypoint["value"] for keypoint in keypoints],
+            ))
+            positions.append((label_idx, params.index(param)))
+    return labels, params, tracks, positions
+
+def time_grid(t_start, t_end, timestep) :
+    # Single time grid for all the tracks, the last step is the end of the longest track
+    nb_steps = int(round((t_end - t_start) / timestep)) + 1
+    times = np.minimum(t_start + np.arange(nb_steps) * timestep, t_end)
+    times[-1] = t_end
+    return times
+
 def make_sequence(sequence_config) :
     # retireve step time and remove it from the config
     timestep = sequence_config["timestep"]
     del sequence_config["timestep"]
 
-    temp = {}
+    labels, params, tracks, positions = sequence_tracks(sequence_config)
+    index = TrackIndex(tracks)
+    times = time_grid(index.t_min, index.t_max, timestep)
 
-    # Interpolate each wave
-    for freq_label, config in sequence_config.items() :
-        interpolated = {}
-        for param, keypoints in config.items() :
-            values = []
-            for idx in range(len(keypoints)-1) :
-                t1, v1 = keypoints[idx]["time"], keypoints[idx]["value"]
-                t2, v2 = keypoints[idx + 1]["time"], keypoints[idx + 1]["value"]
-                nb_steps = int(round((t2 - t1) / timestep))
-                interp = np.linspace(v1, v2, nb_steps, endpoint=False)
-                values.append(interp)
-            values.append([keypoints[-1]["value"]]) # Add final value
-            interpolated[param] = np.concatenate(values)
-        temp[freq_label] = interpolated
-
-    # Compute gloabal max length
-    max_len = max(len(arr) for wave in temp.values() for arr in wave.values())
-
-    # Pad to all same length
-    for interpolated in temp.values() :
-        for param, arr in interpolated.items() :
-            if len(arr) < max_len :
-                padded = np.pad(arr, (0, max_len - len(arr)), mode="constant", constant_values=arr[-1])
-                interpolated[param] = padded
-
-    # Build the sequence (per step dictionnaries)
-    sequence = []
-    for i in range(max_len) :
-        step = {}
-        for freq_label, interpolated in temp.items():
-            step[freq_label] = {param: arr[i] for param, arr in interpolated.items()}
-        sequence.append(step)
-        
-    return sequence
+    # Build the sequence : one (steps, components, params) array, NaN where a wave has no track
+    values = np.full((len(times), len(labels), len(params)), np.nan)
+    label_idx, param_idx = np.array(positions).T
+    values[:, label_idx, param_idx] = index.evaluate(times)
+
+    return Sequence(values, labels, params, timestep)
+
+def make_keyframe_sequence(sequence_config, timestep=None) :
+    # Lazy sequence of a config, timestep defaults to the one of the config (the config is not modified)
+    sequence_config = dict(sequence_config)
+    authored_timestep = sequence_config.pop("timestep")
+    labels, params, tracks, positions = sequence_tracks(sequence_config)
+    return KeyframeSequence(TrackIndex(tracks), labels, params, positions, timestep if timestep is not None else authored_timestep)
+
+
+class KeyframeSequence :
+    # Sequence evaluated on demand from the keypoints : memory is proportional to the keypoints, not to the steps
+    # Steps are sampled every timestep (any playback rate, independent of the authored timestep) from t_start
+    # to t_end, at(t) evaluates any time. Same step interface as Sequence, so the player accepts both
+    def __init__(self, track_index, labels, params, positions, timestep) :
+        self.track_index = track_index
+        self.labels = list(labels)
+        self.params = list(params)
+        self.label_index = {label : idx for idx, label in enumerate(self.labels)}
+        self.positions = np.array(positions, dtype=np.intp).reshape(-1, 2)
+        self.present = {label : [] for label in self.labels}
+        for label_idx, param_idx in sorted(positions, key=lambda position : position[1]) :
+            self.present[self.labels[label_idx]].append((self.params[param_idx], param_idx))
+        self.t_start = track_index.t_min
+        self.t_end = track_index.t_max
+        self.set_timestep(timestep)
+
+    @property
+    def duration(self) :
+        return self.t_end - self.t_start
+
+    def set_timestep(self, timestep) :
+        self.timestep = timestep
+        self.nb_steps = int(round(self.duration / timestep)) + 1
+
+    def __len__(self) :
+        return self.nb_steps
+
+    def time_of(self, index) :
+        # Time of a step, the last step is the end of the sequence
+        return self.t_end if index >= self.nb_steps - 1 else min(self.t_start + index * self.timestep, self.t_end)
+
+    def index_at(self, t) :
+        return int(np.clip(round((t - self.t_start) / self.timestep), 0, self.nb_steps - 1))
+
+    def values_at(self, times) :
+        # (times, components, params) array, NaN for the params not in the sequence
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        values = np.full((len(times), len(self.labels), len(self.params)), np.nan)
+        values[:, self.positions[:, 0], self.positions[:, 1]] = self.track_index.evaluate(times)
+        return values
+
+    def at(self, t) :
+        # Step at any time t
+        return SequenceStep(self, None, self.values_at(t)[0])
+
+    def __getitem__(self, index) :
+        if index < 0 :
+            index += len(self)
+        if not 0 <= index < len(self) :
+            raise IndexError("Sequence index out of range")
+        return SequenceStep(self, index, self.values_at(self.time_of(index))[0])
+
+    def __iter__(self) :
+        for index in range(len(self)) :
+            yield self[index]
+
+    def track(self, label, param) :
+        # Values of one parameter at every step
+        times = [self.time_of(index) for index in range(len(self))]
+        return self.values_at(times)[:, self.label_index[label], self.params.index(param)]
+
+def apply_step(freq_params, step) :
+    # Parameters after a sequence step, same rules as the editor : unknown labels are ignored
+    # and angle / phase are wrapped in [0, 360[
+    new_params = dict(freq_params)
+    for freq_label, param_dict in step.items() :
+        if freq_label not in new_params :
+            continue
+        params = dict(new_params[freq_label])
+        for param, value in param_dict.items() :
+            if param in params :
+                params[param] = value % 360.0 if param in ["angle", "phase"] else value
+        new_params[freq_label] = params
+    return new_params
 
 def make_sequence_player(sequence_config, callback=None) :
-    timestep = sequence_config["timestep"]
     sequence = make_sequence(sequence_config)
-    sequence_player = SequencePlayer(sequence, timestep=timestep, callback=callback)
+    sequence_player = SequencePlayer(sequence, timestep=sequence.timestep, callback=callback)
     return sequence_player
 
 
 class SequencePlayer :
-    def __init__(self, sequence=None, timestep=0.1, callback=None) :
+    # Plays the steps of a sequence on a thread, step i is due at its deadline on the monotonic clock
+    # mode "realtime" : when the callback overruns, the steps whose deadline has passed are dropped
+    #                   and the newest due step is played, so the sequence keeps its wall clock duration
+    # mode "every" : every step is played, a late step delays the following ones
+    # rate multiplies the playback speed, pause / resume / stop / seek wake the thread immediately
+    # loop restarts from the first step after the last one
+    def __init__(self, sequence=None, timestep=0.1, callback=None, mode="realtime", rate=1.0, late_tolerance=0.005, loop=False) :
 
         self.sequence = sequence
         self.timestep = timestep
         self.callback = callback
+        self.mode = mode
+        self.rate = rate
+        self.loop = loop
+        # A step delivered more than late_tolerance seconds after its deadline is counted as late
+        self.late_tolerance = late_tolerance
 
         self.thread = None
         self.running = False
         self.paused = False
+        self.condition = threading.Condition()
+        # Index of the step being played, and of the next step to play
+        self.index = None
+        self.next_index = 0
+        # Deadlines are anchor_time + (index - anchor_index) * timestep / rate
+        self.anchor_time = None
+        self.anchor_index = 0
+        self.pause_time = None
 
         self.time = time.time()
+        # Optional core.instrumentation.Instrumentation receiving the delivery lag of each step
+        self.instrumentation = None
+        self.reset_stats()
+
+    def reset_stats(self) :
+        self.nb_delivered = 0
+        self.nb_dropped = 0
+        self.nb_late = 0
+        self.max_lag = 0.0
+
+    def stats(self) :
+        return {
+            "delivered" : self.nb_delivered,
+            "dropped" : self.nb_dropped,
+            "late" : self.nb_late,
+            "max_lag" : self.max_lag,
+        }
 
     def start(self):
+        if self.sequence is None :
+            return
         if self.thread is None or not self.thread.is_alive() :
+            if self.next_index >= len(self.sequence) :
+                self.next_index = 0
             self.running = True
             self.paused = False
+            self.reset_stats()
             self.thread = threading.Thread(target=self.run, daemon=True)
             self.thread.start()
 
     def pause(self) :
-        self.paused = True
+        with self.condition :
+            if not self.paused :
+                self.paused = True
+                self.pause_time = time.monotonic()
+            self.condition.notify_all()
 
     def resume(self) :
-        self.paused = False
+        with self.condition :
+            if self.paused :
+                self.paused = False
+                # The remaining deadlines are pushed back by the pause duration
+                if self.anchor_time is not None and self.pause_time is not None :
+                    self.anchor_time += time.monotonic() - self.pause_time
+            self.condition.notify_all()
 
     def stop(self) : 
-        self.running = False
-        self.paused = False
+        with self.condition :
+            self.running = False
+            self.paused = False
+            self.next_index = 0
+            self.condition.notify_all()
+
+    def seek(self, index) :
+        # Play from step index on, now (or at resume when paused)
+        with self.condition :
+            self.next_index = max(0, min(index, len(self.sequence) - 1))
+            self.anchor_index = self.next_index
+            self.anchor_time = time.monotonic()
+            if self.paused :
+                self.pause_time = self.anchor_time
+            self.condition.notify_all()
+
+    def set_loop(self, loop) :
+        with self.condition :
+            self.loop = loop
+            self.condition.notify_all()
+
+    def deadline(self, index) :
+        return self.anchor_time + (index - self.anchor_index) * self.timestep / self.rate
 
     def run(self) :
-        for step in self.sequence :
+        with self.condition :
+            self.anchor_time = time.monotonic()
+            self.anchor_index = self.next_index
+        while True :
+            with self.condition :
+                if self.next_index >= len(self.sequence) :
+                    if not self.loop :
+                        break
+                    # The last step keeps its duration, then the sequence starts over
+                    self.anchor_time = self.deadline(len(self.sequence))
+                    self.anchor_index = 0
+                    self.next_index = 0
+                # Wait for the deadline, or for resume while paused (a seek moves next_index)
+                while self.running and (self.paused or time.monotonic() < self.deadline(self.next_index)) :
+                    if self.paused :
+                        self.condition.wait()
+                    else :
+                        self.condition.wait(self.deadline(self.next_index) - time.monotonic())
+                if not self.running :
+                    break
+                index = self.next_index
+                now = time.monotonic()
+                if self.mode == "realtime" :
+                    # Newest step already due, the ones before it are dropped
+                    due = self.anchor_index + int((now - self.anchor_time) * self.rate / self.timestep)
+                    due = min(due, len(self.sequence) - 1)
+                    if due > index :
+                        self.nb_dropped += due - index
+                        index = due
+                lag = now - self.deadline(index)
+                if self.mode == "every" and lag > 0 :
+                    # Following steps keep their spacing from this late one
+                    self.anchor_index = index
+                    self.anchor_time = now
+                self.next_index = index + 1
+                # Read under the lock : a resample never changes the sequence between the index and the step
+                step = self.sequence[index]
+            if lag > self.late_tolerance :
+                self.nb_late += 1
+            self.max_lag = max(self.max_lag, lag)
+            if self.instrumentation is not None :
+                self.instrumentation.record("player_lag", lag)
+                self.instrumentation.mark("steps")
+            self.index = index
             self.time = time.time()
-            if not self.running :
-                break
-            while self.paused :
-                time.sleep(0.05)
             if self.callback:
                 self.callback(step)
-            to_sleep = max(0, self.timestep - (time.time() - self.time))
-            time.sleep(to_sleep)
+            self.nb_delivered += 1
 
     def set_sequence(self, sequence) :
-        self.sequence = sequence
+        with self.condition :
+            self.sequence = sequence
 
     def set_timestep(self, timestep) :
-        self.timestep = timestep
+        with self.condition :
+            self.timestep = timestep
+
+    def resample(self, timestep) :
+        # Change the timestep of a KeyframeSequence while it plays : the sequence, the deadlines and the
+        # position (kept at the same time) change together, the thread never sees the new length with old indices
+        with self.condition :
+            index = self.index if self.index is not None else self.next_index
+            current_time = self.sequence.time_of(min(index, len(self.sequence) - 1))
+            self.sequence.set_timestep(timestep)
+            self.timestep = timestep
+            new_index = self.sequence.index_at(current_time)
+            if self.index is not None :
+                self.index = new_index
+            self.seek(new_index)
+
+    def set_rate(self, rate) :
+        # Re-anchor the deadlines on the next step so the speed changes from now on
+        with self.condition :
+            if self.anchor_time is not None and self.index is not None :
+                now = time.monotonic()
+                next_deadline = max(now, self.deadline(self.index + 1))
+                self.anchor_index = self.index + 1
+                self.anchor_time = now + (next_deadline - now) * self.rate / rate
+            self.rate = rate
+            self.condition.notify_all()
+
+    def set_mode(self, mode) :
+        self.mode = mode
 
 if __name__ == "__main__" :
     from tkinter import *
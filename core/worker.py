@@ -0,0 +1,108 @@
+import time
+import threading
+import traceback
+from core.render import Renderer, RenderCancelled
+
+
+class RenderWorker :
+    # Renders RenderParams snapshots on a background thread, the newest snapshot always wins :
+    #   - a snapshot waiting to start is replaced by a newer one (dropped)
+    #   - a running render is cancelled between stages when a newer snapshot arrives (cancelled),
+    #     unless no frame was delivered for more than max_stall seconds, so the display keeps moving
+    #     during long continuous edits
+    # Finished frames are collected from the main loop with poll(), the worker never touches the UI
+    # A thread is enough : numpy releases the GIL in the heavy parts (sin/cos, matmul, FFT, colormap indexing)
+    def __init__(self, renderer=None, max_stall=0.25) :
+        self.renderer = renderer if renderer is not None else Renderer()
+        self.max_stall = max_stall
+
+        self.condition = threading.Condition()
+        self.job_id = 0
+        self.pending = None
+        self.running_id = None
+        self.result = None
+        self.last_delivery = time.monotonic()
+        self.alive = True
+
+        # Statistics
+        self.nb_submitted = 0
+        self.nb_dropped = 0
+        self.nb_cancelled = 0
+        self.nb_completed = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, params, force=False) :
+        # force reruns every stage (e.g. explicit regenerate)
+        with self.condition :
+            self.job_id += 1
+            self.nb_submitted += 1
+            if self.pending is not None :
+                self.nb_dropped += 1
+            self.pending = (self.job_id, params, force)
+            self.condition.notify()
+            return self.job_id
+
+    def is_superseded(self, job_id) :
+        with self.condition :
+            stalled = time.monotonic() - self.last_delivery > self.max_stall
+            return job_id != self.job_id and not stalled
+
+    def busy(self) :
+        with self.condition :
+            return self.pending is not None or self.running_id is not None or self.result is not None
+
+    def poll(self) :
+        # Latest finished (job_id, params, frame) or None, to call from the main loop
+        with self.condition :
+            result, self.result = self.result, None
+            return result
+
+    def run(self) :
+        while True :
+            with self.condition :
+                while self.pending is None and self.alive :
+                    self.condition.wait()
+                if not self.alive :
+                    return
+                job_id, params, force = self.pending
+                self.pending = None
+                self.running_id = job_id
+            try :
+                if force :
+                    self.renderer.invalidate()
+                frame = self.renderer.render(params, cancelled=lambda: self.is_superseded(job_id))
+            except RenderCancelled :
+                with self.condition :
+                    self.nb_cancelled += 1
+                    self.running_id = None
+                continue
+            except Exception :
+                # Keep the worker alive, the next snapshot may be valid
+                traceback.print_exc()
+                self.renderer.invalidate()
+                with self.condition :
+                    self.running_id = None
+                continue
+            with self.condition :
+                self.running_id = None
+                self.nb_completed += 1
+                # Frames are only handed over in submission order
+                if self.result is None or self.result[0] < job_id :
+                    self.result = (job_id, params, frame)
+                self.last_delivery = time.monotonic()
+
+    def stop(self) :
+        with self.condition :
+            self.alive = False
+            self.condition.notify()
+
+    def stats(self) :
+        with self.condition :
+            return {
+                "submitted" : self.nb_submitted,
+                "dropped" : self.nb_dropped,
+                "cancelled" : self.nb_cancelled,
+                "completed" : self.nb_completed,
+            }
@@ -0,0 +1,153 @@
+import os
+import sys
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from core.model import load_frequencies_dict, DEFAULT_WAVE_PARAMS
+from core.sequence import load_sequence_config, make_keyframe_sequence, apply_step
+from core.render import Renderer, RenderParams
+from core.fft import get_fft_backend
+from render_batch import parse_size, THREAD_LIMIT_VARIABLES
+
+# Extensions written as a single animated file, anything else is a directory of numbered frames
+ANIMATION_FORMATS = (".gif", ".webp", ".png", ".apng")
+
+# State of the worker process, built once by init_worker
+_sequence = None
+_params = None
+_renderer = None
+
+
+def init_worker(sequence_config, params, dtype, fft_backend, threads) :
+    global _sequence, _params, _renderer
+    # Only the small config crosses the process boundary, each worker evaluates its steps from the keypoints
+    _sequence = make_keyframe_sequence(sequence_config)
+    _params = params
+    _renderer = Renderer(dtype, get_fft_backend(fft_backend, workers=threads))
+
+def render_range(start, stop) :
+    # Frames [start, stop[ of the sequence. Every step holds all the sequenced values,
+    # so a step applied to the base parameters gives the same waves as the player stepping through
+    frames = []
+    for index in range(start, stop) :
+        freq_params = apply_step(_params.freq_params, _sequence[index])
+        frames.append(_renderer.render(replace(_params, freq_params=freq_params)))
+    return frames
+
+def base_frequencies(sequence_config, filename=None) :
+    # Waves before the sequence : the saved frequency file, completed with defaults for the sequenced labels
+    freq_params = load_frequencies_dict(filename) if filename else {}
+    for label in sequence_config :
+        if label != "timestep" and label not in freq_params :
+            freq_params[label] = dict(DEFAULT_WAVE_PARAMS)
+    return freq_params
+
+def render_frames(sequence_config, params, options) :
+    # Yields the frames in order. Chunks of frames are rendered by the worker processes, at most
+    # options.window chunks are in flight so memory does not grow with the sequence length
+    # Steps are evaluated on demand : memory does not grow with the number of steps
+    nb_frames = len(make_keyframe_sequence(sequence_config))
+    chunks = [(start, min(start + options.chunksize, nb_frames)) for start in range(0, nb_frames, options.chunksize)]
+    initargs = (sequence_config, params, options.dtype, options.fft_backend, options.threads)
+
+    if options.jobs <= 1 :
+        init_worker(*initargs)
+        for start, stop in chunks :
+            yield from render_range(start, stop)
+        return
+
+    # Workers are spawned (not forked) so the thread limits apply to the libraries they load
+    for variable in THREAD_LIMIT_VARIABLES :
+        os.environ.setdefault(variable, str(options.threads))
+    context = multiprocessing.get_context("spawn")
+    window = options.window if options.window is not None else 2 * options.jobs
+    with ProcessPoolExecutor(options.jobs, mp_context=context, initializer=init_worker, initargs=initargs) as executor :
+        pending = iter(chunks)
+        in_flight = deque()
+        for start, stop in pending :
+            in_flight.append(executor.submit(render_range, start, stop))
+            if len(in_flight) >= window :
+                break
+        while in_flight :
+            # Oldest chunk first : frames come out in sequence order
+            frames = in_flight.popleft().result()
+            chunk = next(pending, None)
+            if chunk is not None :
+                in_flight.append(executor.submit(render_range, *chunk))
+            yield from frames
+
+def write_frames(frames, output, duration) :
+    # Stream the frames to numbered images in the output directory, returns the number of frames
+    os.makedirs(output, exist_ok=True)
+    from PIL import Image
+    nb_frames = 0
+    for index, frame in enumerate(frames) :
+        Image.fromarray(frame).save(os.path.join(output, f"frame_{index:05d}.png"))
+        nb_frames += 1
+    return nb_frames
+
+def write_animation(frames, output, duration) :
+    # Single animated file, PIL pulls the frames from the generator while encoding
+    from PIL import Image
+    counter = [0]
+    def images() :
+        for frame in frames :
+            counter[0] += 1
+            yield Image.fromarray(frame)
+    images = images()
+    first = next(images, None)
+    if first is None :
+        return 0
+    output_format = "PNG" if output.lower().endswith(".apng") else None
+    first.save(output, format=output_format, save_all=True, append_images=images, duration=duration, loop=0)
+    return counter[0]
+
+def make_parser() :
+    parser = argparse.ArgumentParser(description="Export a sequence to an animation or numbered frames without a display")
+    parser.add_argument("sequence", help="sequence JSON file")
+    parser.add_argument("output", help="animation file (.gif, .webp, .png, .apng) or directory for numbered frames")
+    parser.add_argument("-p", "--frequencies", default=None, help="frequency JSON file with the waves before the sequence")
+    parser.add_argument("--fps", type=float, default=None, help="frames per second (default : one frame per sequence timestep)")
+    parser.add_argument("-n", "--nb-samples", type=int, default=150, help="number of samples per axis")
+    parser.add_argument("-l", "--length", type=float, default=1.0, help="length of the sampled square")
+    parser.add_argument("-s", "--size", type=parse_size, default=None, help="image size, WIDTHxHEIGHT (default : one pixel per sample)")
+    parser.add_argument("-c", "--cmap", default="gray", help="matplotlib colormap name")
+    parser.add_argument("-f", "--fourier", choices=("mag", "phase"), default=None, help="render the Fourier transform magnitude or phase")
+    parser.add_argument("--direct-spectrum", action="store_true", help="compute the spectrum from the parameters instead of a 2D FFT")
+    parser.add_argument("--dtype", default="float64", choices=("float32", "float64"))
+    parser.add_argument("--fft-backend", default=None, help="numpy, scipy or pyfftw (default : best available)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker process")
+    parser.add_argument("--chunksize", type=int, default=4, help="frames rendered by a worker at once")
+    parser.add_argument("--window", type=int, default=None, help="chunks in flight (default : twice the number of jobs)")
+    return parser
+
+def main(argv=None) :
+    options = make_parser().parse_args(argv)
+    sequence_config = load_sequence_config(options.sequence)
+    if options.fps is not None :
+        # Sample the sequence at the output frame rate
+        sequence_config["timestep"] = 1.0 / options.fps
+    timestep = sequence_config["timestep"]
+
+    params = RenderParams(
+        freq_params=base_frequencies(sequence_config, options.frequencies),
+        length=options.length,
+        nb_samples=options.nb_samples,
+        fourier=options.fourier is not None,
+        phase=options.fourier == "phase",
+        direct_spectrum=options.direct_spectrum,
+        cmap=options.cmap,
+        display_shape=options.size,
+    )
+    frames = render_frames(sequence_config, params, options)
+    writer = write_animation if options.output.lower().endswith(ANIMATION_FORMATS) else write_frames
+    nb_frames = writer(frames, options.output, duration=int(round(timestep * 1000)))
+    print(f"{nb_frames} frames written to {options.output}")
+    return 0
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
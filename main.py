@@ -1,13 +1,24 @@
+import time
+start_time = time.perf_counter()
+import os
+import sys
 from tkinter import *
 from viewer.app import WaveViewer
-import os
 
 if __name__ == "__main__" :
     root = Tk()
     root.title("Wave Viewer")
     initialdir = os.path.abspath(os.path.join(os.path.dirname(__file__), "saves"))
-    wave_viewer = WaveViewer(root, initialdir)
+    wave_viewer = WaveViewer(root, initialdir, start_time=start_time)
     wave_viewer.grid(column=1, row=1, sticky="news")
     root.grid_columnconfigure(0, weight=1)
     root.grid_rowconfigure(0, weight=1)
-    root.mainloop()
\ No newline at end of file
+    if "--startup-timing" in sys.argv :
+        # Import, window and first frame times since the start of the process
+        def report() :
+            if "first_frame" in wave_viewer.startup_times :
+                print("Start up :", wave_viewer.startup_report())
+            else :
+                root.after(10, report)
+        report()
+    root.mainloop()
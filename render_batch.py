@@ -0,0 +1,140 @@
+import os
+import sys
+import glob
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from core.model import load_frequencies_dict
+from core.render import Renderer, RenderParams
+from core.fft import get_fft_backend
+
+# Renderer of the worker process, built once by init_worker and reused for every file
+_renderer = None
+_options = None
+
+# Environment variables limiting the thread pools of the numerical libraries in the workers
+THREAD_LIMIT_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def init_worker(options) :
+    global _renderer, _options
+    # One process per core : the FFT runs single threaded in each worker
+    _renderer = Renderer(options.dtype, get_fft_backend(options.fft_backend, workers=options.threads))
+    _options = options
+
+def render_file(filename, output) :
+    # Render one saved frequency file to the image output, run in a worker process
+    from PIL import Image
+    options = _options
+    params = RenderParams(
+        freq_params=load_frequencies_dict(filename),
+        length=options.length,
+        nb_samples=options.nb_samples,
+        fourier=options.fourier is not None,
+        phase=options.fourier == "phase",
+        direct_spectrum=options.direct_spectrum,
+        cmap=options.cmap,
+        display_shape=options.size,
+    )
+    frame = _renderer.render(params)
+    Image.fromarray(frame).save(output)
+    return output
+
+def collect_files(inputs) :
+    # Files, directories (every .json inside) and glob patterns
+    files = []
+    for path in inputs :
+        if os.path.isdir(path) :
+            files.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        elif os.path.exists(path) :
+            files.append(path)
+        else :
+            files.extend(sorted(glob.glob(path)))
+    return list(dict.fromkeys(files))
+
+def output_paths(files, output, extension) :
+    # Image of each file : its path relative to the deepest directory common to all the files,
+    # so files with the same name in different directories do not overwrite each other
+    directories = [os.path.dirname(os.path.abspath(filename)) for filename in files]
+    root = os.path.commonpath(directories) if len(directories) > 0 else ""
+    paths = {}
+    for filename, directory in zip(files, directories) :
+        name = os.path.splitext(os.path.basename(filename))[0] + "." + extension
+        paths[filename] = os.path.normpath(os.path.join(output, os.path.relpath(directory, root), name))
+    return paths
+
+def parse_size(value) :
+    # "WIDTHxHEIGHT" or a single number for a square image
+    width, _, height = value.lower().partition("x")
+    width = int(width)
+    return (int(height) if height else width, width)
+
+def make_parser() :
+    parser = argparse.ArgumentParser(description="Render saved frequency files to images without a display")
+    parser.add_argument("inputs", nargs="+", help="frequency JSON files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="renders", help="output directory")
+    parser.add_argument("-n", "--nb-samples", type=int, default=150, help="number of samples per axis")
+    parser.add_argument("-l", "--length", type=float, default=1.0, help="length of the sampled square")
+    parser.add_argument("-s", "--size", type=parse_size, default=None, help="image size, WIDTHxHEIGHT (default : one pixel per sample)")
+    parser.add_argument("-c", "--cmap", default="gray", help="matplotlib colormap name")
+    parser.add_argument("-f", "--fourier", choices=("mag", "phase"), default=None, help="render the Fourier transform magnitude or phase")
+    parser.add_argument("--direct-spectrum", action="store_true", help="compute the spectrum from the parameters instead of a 2D FFT")
+    parser.add_argument("--format", default="png", help="image file extension")
+    parser.add_argument("--dtype", default="float64", choices=("float32", "float64"))
+    parser.add_argument("--fft-backend", default=None, help="numpy, scipy or pyfftw (default : best available)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker process")
+    parser.add_argument("--chunksize", type=int, default=8, help="files sent to a worker at once")
+    return parser
+
+def render_files(files, options) :
+    # Render the files across a process pool, yields (filename, output or None, error or None) as they finish
+    outputs = output_paths(files, options.output, options.format)
+    for directory in set(os.path.dirname(output) for output in outputs.values()) :
+        os.makedirs(directory, exist_ok=True)
+    jobs = list(outputs.items())
+    if options.jobs <= 1 :
+        init_worker(options)
+        yield from render_chunk(jobs)
+        return
+
+    # Workers are spawned (not forked) so the thread limits apply to the libraries they load
+    for variable in THREAD_LIMIT_VARIABLES :
+        os.environ.setdefault(variable, str(options.threads))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(options.jobs, mp_context=context, initializer=init_worker, initargs=(options,)) as executor :
+        # Files are submitted by chunks so the pool never holds thousands of pending futures
+        chunks = [jobs[i:i + options.chunksize] for i in range(0, len(jobs), options.chunksize)]
+        futures = {executor.submit(render_chunk, chunk) : chunk for chunk in chunks}
+        for future in as_completed(futures) :
+            yield from future.result()
+
+def render_chunk(jobs) :
+    # jobs : (frequency file, image file) pairs
+    results = []
+    for filename, output in jobs :
+        try :
+            results.append((filename, render_file(filename, output), None))
+        except Exception as error :
+            results.append((filename, None, error))
+    return results
+
+def main(argv=None) :
+    options = make_parser().parse_args(argv)
+    files = collect_files(options.inputs)
+    if len(files) == 0 :
+        print("No frequency file found", file=sys.stderr)
+        return 1
+
+    nb_errors = 0
+    for index, (filename, output, error) in enumerate(render_files(files, options)) :
+        if error is not None :
+            nb_errors += 1
+            print(f"[{index + 1}/{len(files)}] {filename} : {error}", file=sys.stderr)
+        else :
+            print(f"[{index + 1}/{len(files)}] {output}")
+    return 1 if nb_errors > 0 else 0
+
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -1,26 +1,69 @@
+import time
+import json
+import threading
+from dataclasses import replace
 from tkinter import *
 from tkinter import ttk
-from core.events import EventBus, Events
+from core.events import EventBus, Events, Change, MainLoopChannel, flatten_changes
 from widgets.entry_bundle import EntryBundle
 from widgets.frequency_editor import FrequencyEditor
 from widgets.save_manager import SaveManager
 from widgets.sequence_manager import SequenceManager
-from core.generation import generate_wave, apply_fourier_transform
-import matplotlib.pyplot as plt
-import numpy as np
-from PIL import Image, ImageTk
+from core.render import Renderer, RenderParams
+from core.worker import RenderWorker
+from core.colormap import preload_luts
+from core.instrumentation import Instrumentation
 
 
 class WaveViewer(ttk.Frame) :
-    def __init__(self, root, initialdir) :
+    # Parameters of one wave (Change with a label) and parameters not stored in the frequency editor
+    WAVE_PARAMS = ("frequency", "amplitude", "phase", "angle")
+    VIEW_PARAMS = ("nb_samples", "length", "fourier", "ftype", "direct_spectrum", "cmap")
+
+    def __init__(self, root, initialdir, dtype="float64", fft_backend=None, coalesce=True, frame_budget=None, threaded=True, poll_interval=10, player_queue_size=1, instrument=False, overlay=False, defer_first_render=True, start_time=None, interactive=True, preview_factor=4, refine_delay=150, preview_min_samples=64) :
         super().__init__(root)
-        # Setup the event bus
-        self.event_bus = EventBus()
-        self.event_bus.subscribe(Events.PARAM_CHANGE, self.on_param_change)
-        self.event_bus.subscribe(Events.DISPLAY_CHANGE, self.on_display_change)
+        # Interactive mode : while a scale is dragged, renders use preview_factor times fewer samples,
+        # the full resolution render follows once the input has been idle for refine_delay ms
+        self.interactive = interactive
+        self.preview_factor = preview_factor
+        self.refine_delay = refine_delay
+        self.preview_min_samples = preview_min_samples
+        self.dragging = False
+        self.refine_job = None
+        # The last render asked is a coarse preview, a full resolution render is still due
+        self.showing_preview = False
+        # Start up timings, from start_time (e.g. the start of main.py) or the creation of the viewer
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.startup_times = {}
+        # Optional timings of the render stages, blit, event to pixel latency and player lag (None when disabled)
+        self.instrumentation = Instrumentation() if instrument or overlay else None
+        # Time of the oldest event of each render not displayed yet, by job id
+        self.render_origins = {}
+        # Render pipeline, the stages to rerun are found by comparing the parameters with the previous render
+        self.renderer = Renderer(dtype, fft_backend, instrumentation=self.instrumentation)
+        # Background rendering : the window stays responsive and the newest parameters always win
+        self.render_worker = RenderWorker(self.renderer) if threaded else None
+        self.poll_interval = poll_interval
+        self.polling = False
+        # Cached wave parameters (None to read them all again)
+        self.freq_params = None
+        self.stale_labels = set()
+
+        # Setup the event bus, when coalescing, bursts of changes are rendered once per idle cycle (or frame budget in ms)
+        self.event_bus = EventBus(scheduler=root if coalesce else None, frame_budget=frame_budget)
+        self.event_bus.subscribe(Events.PARAM_CHANGE, self.on_param_change, with_payload=True)
+        self.event_bus.subscribe(Events.DISPLAY_CHANGE, self.on_display_change, with_payload=True)
         self.event_bus.subscribe(Events.PLAYER_STEP, self.on_step)
+        # Sequence steps and frames come from the player thread, they are handed to the main loop
+        # through a bounded channel : the display is never more than one step behind the player
+        # Polled only while the player delivers steps, started by the sequence manager
+        self.player_channel = MainLoopChannel(root, self.on_player_item, maxsize=player_queue_size, latest_wins=True, busy=lambda: self.sequence_manager.playing())
 
         self.root = root
+        if interactive :
+            # Every ttk.Scale (entry bundles, editor rows, sequence time) marks the drags
+            self.root.bind_class("TScale", "<ButtonPress-1>", self.on_drag_start, add="+")
+            self.root.bind_class("TScale", "<ButtonRelease-1>", self.on_drag_end, add="+")
         mainframe = ttk.Frame(self.root)
         mainframe.grid(column=0, row=0, sticky=(N, W, E, S))
 
@@ -39,7 +82,7 @@ class WaveViewer(ttk.Frame) :
             add_scale=True, 
             from_=2,
             to=500,
-            callback=lambda: self.event_bus.publish(Events.PARAM_CHANGE),
+            callback=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("nb_samples")),
             uniform="params"
             )
         self.sample_bundle.grid(column=0, row=0, sticky="nsew")
@@ -53,7 +96,7 @@ class WaveViewer(ttk.Frame) :
             add_scale=True,
             from_=1,
             to=10,
-            callback=lambda: self.event_bus.publish(Events.PARAM_CHANGE), 
+            callback=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("length")),
             uniform="params"
             )
         self.length_bundle.grid(column=1, row=0, sticky="nsew")
@@ -73,7 +116,16 @@ class WaveViewer(ttk.Frame) :
         self.save_manager.grid(column=1, row=0, sticky="news")
 
         #---------------Sequence Manager--------------------
-        self.sequence_manager = SequenceManager(top_frame, initialdir=initialdir, callback=self.on_step)
+        self.sequence_manager = SequenceManager(
+            top_frame,
+            initialdir=initialdir,
+            callback=self.on_step,
+            frame_callback=self.on_frame,
+            render_params=self.get_render_params,
+            dtype=dtype,
+            fft_backend=fft_backend,
+            on_play=self.player_channel.start,
+            )
         self.sequence_manager.grid(column=2, row=0, sticky="news")
 
         #-------------TopFrame grid configure-----------------
@@ -85,7 +137,7 @@ class WaveViewer(ttk.Frame) :
         bottom_frame.grid(column=0, row=1, sticky="news")
 
         #----------------Frequency Editor---------------------
-        self.freq_editor = FrequencyEditor(bottom_frame, callback=lambda: self.event_bus.publish(Events.PARAM_CHANGE))
+        self.freq_editor = FrequencyEditor(bottom_frame, callback=lambda change: self.event_bus.publish(Events.PARAM_CHANGE, change))
         self.freq_editor.grid(column=0, row=0, sticky="nesw")
         # Set the load command in the save manager
         self.save_manager.set_load_command(self.freq_editor.load_frequencies)
@@ -97,30 +149,37 @@ class WaveViewer(ttk.Frame) :
 
         self.width, self.height = 500, 500
         self.canvas = Canvas(visu_frame, width=self.width, height=self.height)
+        # Persistent display image and its canvas item
+        self.photo = None
+        self.canvas_image = None
+        self.overlay = None
         self.canvas.grid(column=0, row=0, rowspan=2, sticky=(N, W, E, S))
 
         fourier_frame = ttk.Frame(visu_frame)
         fourier_frame.grid(column=1, row=0, sticky="news")
         self.fourier_checkval = IntVar()
-        fourier_checkbox = ttk.Checkbutton(fourier_frame, text="Fourier Transform", variable=self.fourier_checkval, onvalue=1, offvalue=0, command=lambda: self.event_bus.publish(Events.PARAM_CHANGE))
+        fourier_checkbox = ttk.Checkbutton(fourier_frame, text="Fourier Transform", variable=self.fourier_checkval, onvalue=1, offvalue=0, command=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("fourier")))
         fourier_checkbox.grid(column=0, columnspan=2, row=0, sticky="new")
         self.ftype_var = StringVar(value="mag")
-        ftype_mag_button = ttk.Radiobutton(fourier_frame, text="Magnitude", variable=self.ftype_var, value="mag", command=lambda: self.event_bus.publish(Events.PARAM_CHANGE))
+        ftype_mag_button = ttk.Radiobutton(fourier_frame, text="Magnitude", variable=self.ftype_var, value="mag", command=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("ftype")))
         ftype_mag_button.grid(column=0, row=1, sticky="new")
-        ftype_phase_button = ttk.Radiobutton(fourier_frame, text="Phase", variable=self.ftype_var, value="phase", command=lambda: self.event_bus.publish(Events.PARAM_CHANGE))
+        ftype_phase_button = ttk.Radiobutton(fourier_frame, text="Phase", variable=self.ftype_var, value="phase", command=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("ftype")))
         ftype_phase_button.grid(column=1, row=1, sticky="new")
+        self.direct_spectrum_val = IntVar(value=0)
+        direct_spectrum_checkbox = ttk.Checkbutton(fourier_frame, text="From parameters", variable=self.direct_spectrum_val, onvalue=1, offvalue=0, command=lambda: self.event_bus.publish(Events.PARAM_CHANGE, Change("direct_spectrum")))
+        direct_spectrum_checkbox.grid(column=0, columnspan=2, row=2, sticky="new")
 
         for child in fourier_frame.winfo_children() :
             child.grid_configure(padx=2, pady=5)
 
 
         self.choices = ["gray", "viridis", "magma", "inferno", "managua", "ocean", "plasma", "jet", "coolwarm", "hsv"]
-        self.cmap = plt.get_cmap("gray")
+        self.cmap = "gray"
         choicesvar = StringVar(value=self.choices)
         self.listbox = Listbox(visu_frame, height=min(len(self.choices), 15), selectmode="browse", listvariable=choicesvar)
         self.listbox.grid(column=2, row=0, sticky="n")
         from functools import partial
-        self.listbox.bind("<<ListboxSelect>>", lambda event: self.event_bus.publish(Events.DISPLAY_CHANGE))
+        self.listbox.bind("<<ListboxSelect>>", lambda event: self.event_bus.publish(Events.DISPLAY_CHANGE, Change("cmap")))
 
         generate_button = ttk.Button(visu_frame, text="Generate Image", command=self.update)
         generate_button.grid(column=1, row=1, sticky="se")
@@ -131,53 +190,227 @@ class WaveViewer(ttk.Frame) :
         for child in mainframe.winfo_children():
             child.grid_configure(padx=5, pady=5)
 
+        self.sequence_manager.player.instrumentation = self.instrumentation
+        # F3 toggles the instrumentation overlay
+        self.root.bind("<F3>", lambda event: self.set_overlay(self.overlay is None))
+        if overlay :
+            self.set_overlay(True)
+
+        self.startup_times["init"] = time.perf_counter() - self.start_time
+        if defer_first_render :
+            # The window is shown first, the first render starts once the canvas is mapped
+            self.canvas.bind("<Map>", self.on_first_map)
+        else :
+            self.update()
+
+    def on_first_map(self, event=None) :
+        self.canvas.unbind("<Map>")
+        self.startup_times["window"] = time.perf_counter() - self.start_time
         self.update()
 
+    def on_first_frame(self) :
+        self.startup_times["first_frame"] = time.perf_counter() - self.start_time
+        # Warm the colormap tables of the other choices (and their disk cache for the next start) in the background
+        threading.Thread(target=preload_luts, args=(self.choices, self.renderer.lut_size), daemon=True).start()
+
+    def startup_report(self) :
+        return " - ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_times.items())
+
     def update(self) :
-        self.generate_image()
-        self.display_image()
-
-    def generate_image(self, *args) :
-        # Get general parameters
-        nb_samples = self.sample_bundle.get()
-        length = self.length_bundle.get()
-        # Get frequencies parameters
-        freq_params = self.freq_editor.get_frequencies_param()
-        # Generate wave
-        self.image = generate_wave(freq_params, length, nb_samples)
-        # Fourier transform
-        if self.fourier_checkval.get() :
-            phase = self.ftype_var.get() == "phase"
-            self.image = apply_fourier_transform(self.image, phase)
-
-    def display_image(self) :
-        # Select cmap 
-        if len(self.listbox.curselection()) == 0 :
-            cmap = self.cmap
+        # Full render, parameters are read again from the widgets
+        self.freq_params = None
+        self.render(force=True)
+
+    def get_frequencies_param(self) :
+        # Only the labels named by the last changes are read again from the editor
+        if self.freq_params is None :
+            self.freq_params = self.freq_editor.get_frequencies_param()
         else :
-            cmap = plt.get_cmap(self.choices[self.listbox.curselection()[0]])
-            self.cmap = cmap
-        # Normalize image
-        self.image = (self.image - np.min(self.image)) / (np.max(self.image) - np.min(self.image))
-        # Apply cmap
-        colored_image = cmap(self.image)
-        # Convert image for Tkinter
-        PIL_image = Image.fromarray((colored_image[:,:,:3]*255).astype(np.uint8)).resize((self.width, self.height), resample=Image.Resampling.NEAREST)
-        display = ImageTk.PhotoImage(PIL_image)
-        # Update display
-        self.canvas.delete("all")
-        self.canvas.create_image(0, 0, image=display, anchor="nw")
-        self.canvas.image = display
-
-    def on_param_change(self) :
-        self.generate_image()
-        self.display_image()
-
-    def on_display_change(self) :
-        self.display_image()
+            for label in self.stale_labels :
+                self.freq_params[label] = self.freq_editor.get_frequency_param(label)
+        self.stale_labels.clear()
+        return self.freq_params
+
+    def get_cmap(self) :
+        # Select cmap
+        if len(self.listbox.curselection()) > 0 :
+            self.cmap = self.choices[self.listbox.curselection()[0]]
+        return self.cmap
+
+    def get_render_params(self) :
+        # Snapshot of the widgets state, safe to hand to the render thread
+        return RenderParams(
+            freq_params=dict(self.get_frequencies_param()),
+            length=self.length_bundle.get(),
+            nb_samples=self.sample_bundle.get(),
+            fourier=bool(self.fourier_checkval.get()),
+            phase=self.ftype_var.get() == "phase",
+            direct_spectrum=bool(self.direct_spectrum_val.get()),
+            cmap=self.get_cmap(),
+            display_shape=(self.height, self.width),
+        )
+
+    def render(self, force=False, origin=None, preview=False) :
+        # origin : time of the event that asked for the render, for the event to pixel latency
+        # preview : coarse render, refined at full resolution once the input is idle
+        params = self.get_render_params()
+        if preview and params.nb_samples >= self.preview_min_samples :
+            params = replace(params, nb_samples=max(2, params.nb_samples // self.preview_factor))
+            self.showing_preview = True
+            self.schedule_refine()
+        else :
+            self.showing_preview = False
+            self.cancel_refine()
+        if self.instrumentation is not None and origin is None :
+            origin = time.perf_counter()
+        if self.render_worker is None :
+            if force :
+                self.renderer.invalidate()
+            frame = self.renderer.render(params)
+            self.display_image(frame)
+            if self.instrumentation is not None :
+                self.instrumentation.record("latency", time.perf_counter() - origin)
+        else :
+            job_id = self.render_worker.submit(params, force)
+            if self.instrumentation is not None :
+                self.render_origins[job_id] = origin
+            if not self.polling :
+                self.polling = True
+                self.root.after(self.poll_interval, self.poll_render)
+
+    def poll_render(self) :
+        # Blit the frames finished by the render thread, poll as long as it has work
+        result = self.render_worker.poll()
+        if result is not None :
+            job_id, _, frame = result
+            self.display_image(frame)
+            if self.instrumentation is not None :
+                self.record_latency(job_id)
+        if self.render_worker.busy() :
+            self.root.after(self.poll_interval, self.poll_render)
+        else :
+            self.polling = False
+
+    def record_latency(self, job_id) :
+        # The frame of job_id includes every change submitted before it, the oldest one gives the latency
+        done = [job for job in self.render_origins if job <= job_id]
+        origins = [self.render_origins.pop(job) for job in done]
+        if len(origins) > 0 :
+            self.instrumentation.record("latency", time.perf_counter() - min(origins))
+
+    def display_image(self, frame) :
+        # The frame is already at the canvas size, the same PhotoImage and canvas item are updated in place
+        if self.instrumentation is not None :
+            start = time.perf_counter()
+        # PIL is imported with the first frame, not at start up
+        from PIL import Image, ImageTk
+        PIL_image = Image.fromarray(frame)
+        if self.photo is None or (self.photo.width(), self.photo.height()) != PIL_image.size :
+            self.photo = ImageTk.PhotoImage(PIL_image)
+            if self.canvas_image is None :
+                self.canvas_image = self.canvas.create_image(0, 0, image=self.photo, anchor="nw")
+            else :
+                self.canvas.itemconfig(self.canvas_image, image=self.photo)
+        else :
+            self.photo.paste(PIL_image)
+        if "first_frame" not in self.startup_times :
+            self.on_first_frame()
+        if self.instrumentation is not None :
+            self.instrumentation.lap("blit", start)
+            self.instrumentation.mark("frames")
+
+    def on_param_change(self, changes=()) :
+        if len(changes) == 0 :
+            # Unknown change, every wave parameter is read again
+            self.freq_params = None
+        for change in flatten_changes(changes) :
+            if change.param in self.WAVE_PARAMS and change.label is not None :
+                self.stale_labels.add(change.label)
+            elif change.param not in self.VIEW_PARAMS :
+                # Structural or unknown change, every wave parameter is read again
+                self.freq_params = None
+        self.render(origin=self.event_bus.dispatch_time, preview=self.dragging)
+
+    def on_display_change(self, changes=()) :
+        self.render(origin=self.event_bus.dispatch_time, preview=self.dragging)
+
+    def on_drag_start(self, event=None) :
+        # Input resumes : a pending refinement would be replaced by the next preview anyway
+        self.dragging = True
+        self.cancel_refine()
+
+    def on_drag_end(self, event=None) :
+        self.dragging = False
+        # Always refine a preview, even if the refinement was cancelled by a press without move
+        if self.showing_preview :
+            self.schedule_refine()
+
+    def schedule_refine(self) :
+        # (Re)start the idle timer, a refinement already submitted is cancelled by the worker when a newer render arrives
+        self.cancel_refine()
+        self.refine_job = self.root.after(self.refine_delay, self.refine)
+
+    def cancel_refine(self) :
+        if self.refine_job is not None :
+            self.root.after_cancel(self.refine_job)
+            self.refine_job = None
+
+    def refine(self) :
+        # Exact render at the full resolution
+        self.refine_job = None
+        self.render()
+
+    def set_overlay(self, show, refresh_interval=500) :
+        # Text overlay with the instrumentation summary, refreshed every refresh_interval ms
+        if show and self.overlay is None :
+            if self.instrumentation is None :
+                self.set_instrumentation(True)
+            self.overlay = self.canvas.create_text(4, 4, anchor="nw", fill="yellow", font=("TkFixedFont", 8))
+            self.refresh_overlay(refresh_interval)
+        elif not show and self.overlay is not None :
+            self.canvas.delete(self.overlay)
+            self.overlay = None
+
+    def refresh_overlay(self, refresh_interval) :
+        if self.overlay is None :
+            return
+        self.canvas.itemconfig(self.overlay, text=self.instrumentation.format_overlay())
+        self.canvas.tag_raise(self.overlay)
+        self.root.after(refresh_interval, lambda: self.refresh_overlay(refresh_interval))
+
+    def set_instrumentation(self, enabled) :
+        self.instrumentation = Instrumentation() if enabled else None
+        self.renderer.instrumentation = self.instrumentation
+        self.sequence_manager.player.instrumentation = self.instrumentation
+        self.render_origins.clear()
+
+    def dump_instrumentation(self, filename=None) :
+        # Machine readable dump of the timings with the worker, player and event bus counters
+        summary = self.instrumentation.summary() if self.instrumentation is not None else {}
+        summary["player"] = self.sequence_manager.player.stats()
+        summary["events"] = {event.name if hasattr(event, "name") else str(event) : stats for event, stats in self.event_bus.stats().items()}
+        if self.render_worker is not None :
+            summary["worker"] = self.render_worker.stats()
+        text = json.dumps(summary, indent=1)
+        if filename is not None :
+            with open(filename, "w") as file :
+                file.write(text)
+        return text
 
     def on_step(self, step) :
-        self.root.after_idle(lambda: self.freq_editor.set_frequency_param(step))
+        # Called from the player thread, applied by the main loop (only the newest step is kept)
+        self.player_channel.put(("step", step))
+
+    def on_frame(self, frame) :
+        # Pre-rendered sequence frame, only has to be blitted
+        self.player_channel.put(("frame", frame))
+
+    def on_player_item(self, item) :
+        kind, value = item
+        if kind == "step" :
+            self.freq_editor.set_frequency_param(value)
+        else :
+            self.display_image(value)
 
 if __name__ == "__main__" :
     import os
@@ -1,8 +1,9 @@
 from tkinter import *
 from tkinter import ttk
 from widgets.frequency_frame import FrequencyFrame
-from widgets.scrolled_frame import ScrolledFrame
-from core.model import load_frequencies_dict, save_frequencies_dict
+from widgets.scrolled_frame import VirtualScrolledFrame
+from core.model import FrequencyModel, load_frequencies_dict, save_frequencies_dict
+from core.events import ChangeBatcher, flatten_changes
 import json
 
 class FrequencyEditor(ttk.Frame) :
@@ -10,110 +11,111 @@ class FrequencyEditor(ttk.Frame) :
             self,
             root,
             callback,
+            model=None,
     ) :
         super().__init__(root)
-        self.callback = callback
+        # The callback receives a Change, param "frequencies" when frequencies are added, deleted or loaded
+        # Edits made inside batch() are sent once, as a single BatchChange
+        self.batcher = ChangeBatcher(callback)
+        self.callback = self.batcher.notify
+        # Parameters live in the model, the widgets only show the visible frequencies
+        self.model = model if model is not None else FrequencyModel()
+        self.model.callback = self.callback
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
-        scrolled_canvas = ScrolledFrame(self, vertical=True, horizontal=False)
-        scrolled_canvas.grid(column=0, row=0, sticky="news")
+        # Virtual list : a few recycled rows, whatever the number of frequencies
+        self.rows = VirtualScrolledFrame(self, make_row=self.make_row, bind_row=self.bind_row, vertical=True, horizontal=False)
+        self.rows.grid(column=0, row=0, sticky="news")
+        # Visible frequency frames by label
+        self.visible = {}
 
-        self.frame = ttk.Frame(scrolled_canvas)
-        scrolled_canvas.add(self.frame)
-        self.frame.grid_columnconfigure(0, weight=1)
-
-        # Initialize widgets and button
-        self.frequencies_widgets = {}
-        self.add_button = None
+        # Add button after the entries
+        self.add_button = ttk.Button(self, text="Add", command=self.add_frequency)
+        self.add_button.grid(column=0, row=1, sticky="ew", pady=8)
 
-        # Initialize the first frequency
-        self.frequencies = [1]
-        
         # Build the editor
         self.build()
 
+    @property
+    def frequencies(self) :
+        return self.model.labels
+
+    def make_row(self, parent) :
+        entry_frame = ttk.Frame(parent, padding=(0, 8))
+        entry_frame.grid_columnconfigure(0, weight=0)
+        entry_frame.grid_columnconfigure(1, weight=1)
+        freq_frame = FrequencyFrame(root=entry_frame, name="", callback=self.on_row_change)
+        freq_frame.grid(column=0, row=0, sticky="news")
+        del_button = ttk.Button(
+            entry_frame,
+            text="Delete",
+            command=lambda: self.delete_frequency(freq_frame.label)) # The frame knows the frequency it shows
+        del_button.grid(column=1, row=0, sticky="news")
+        entry_frame.freq_frame = freq_frame
+        return entry_frame
+
+    def bind_row(self, row, index) :
+        freq_frame = row.freq_frame
+        if self.visible.get(freq_frame.label) is freq_frame :
+            del self.visible[freq_frame.label]
+        label = self.model.labels[index]
+        freq_frame.show(label, self.model.params[label])
+        self.visible[label] = freq_frame
+
+    def on_row_change(self, change) :
+        # Edit in a visible row, the value goes to the model which notifies the change
+        for change in flatten_changes([change]) :
+            freq_frame = self.visible.get(change.label)
+            if freq_frame is None :
+                continue
+            try :
+                value = freq_frame.get(change.param)
+            except TclError :
+                # Entry being typed (empty or not a number yet), the model keeps the last valid value
+                continue
+            self.model.set(change.label, change.param, value)
+
     def add_frequency(self) :
-        new_freq = max(self.frequencies) + 1
-        self.frequencies.append(new_freq)
+        label = self.model.add()
         self.build()
-        self.callback()
+        self.rows.see(self.model.labels.index(label))
 
     def delete_frequency(self, freq) :
-        self.frequencies.remove(freq)
+        self.model.delete(freq)
         self.build()
-        self.callback()
+
+    def batch(self) :
+        # Context manager, per variable callbacks are held until the batch commits
+        return self.batcher.batch()
 
     def build(self, freq_dict=None) : # If freq dict passed, will build according to this dict
-        if freq_dict :
-            self.frequencies = list(freq_dict.keys())
-
-        # Clear the frame
-        displayed_frequencies = self.frequencies_widgets.keys()
-        to_remove = set(displayed_frequencies) - set(self.frequencies)
-        if len(to_remove) > 0:
-            for freq in to_remove :
-                self.frequencies_widgets[freq]["entry_frame"].destroy()
-        # Remove element from dict
-        for freq in to_remove :
-            del self.frequencies_widgets[freq]
-
-        # Build every Frequency entries
-        if freq_dict :
-            # If freq dict passed, reload every entries
-            to_add = self.frequencies
-        else :
-            to_add = set(self.frequencies) - set(displayed_frequencies)
-        if len(to_add) > 0:
-            for freq in to_add :
-                entry_frame = ttk.Frame(self.frame)
-                entry_frame.grid_columnconfigure(0, weight=0)
-                entry_frame.grid_columnconfigure(1, weight=1)
-                if freq_dict :
-                    freq_frame = FrequencyFrame(root=entry_frame, name="Frequency " + str(freq), callback=self.callback, params_dict=freq_dict[freq])
-                else :
-                    freq_frame = FrequencyFrame(root=entry_frame, name="Frequency " + str(freq), callback=self.callback)
-                freq_frame.grid(column=0, row=0, sticky="news")
-                del_button = ttk.Button(
-                    entry_frame, 
-                    text="Delete", 
-                    command=lambda i=freq: self.delete_frequency(i)) # Pass parameter to identify the button pressed
-                del_button.grid(column=1, row=0, sticky="news")
-                self.frequencies_widgets[freq] = {"entry_frame":entry_frame, "freq_frame":freq_frame}
-
-        # Position every entries :
-        for idx, freq in enumerate(sorted(self.frequencies)) :
-            self.frequencies_widgets[freq]["entry_frame"].grid(column=0, row=idx, sticky="ew")
+        with self.batch() :
+            if freq_dict :
+                self.model.replace(freq_dict, notify=False)
+            self.rows.set_count(len(self.model))
+            self.rows.refresh()
 
-        # Add button after the entries
-        if self.add_button is not None :
-            self.add_button.destroy()
-        self.add_button = ttk.Button(self.frame, text="Add", command=self.add_frequency)
-        _, nb_row = self.frame.grid_size()
-        self.add_button.grid(column=0, row=nb_row, sticky="ew")
+    def get_frequencies_param(self) :
+        return self.model.get_all()
 
-        # Add y padding to every children of the editor frame
-        for child in self.frame.winfo_children() :
-            child.grid_configure(pady=8)
+    def get_frequency_param(self, freq) :
+        return self.model.get(freq)
 
-    def get_frequencies_param(self) :
-        freq_params = {}
-        for freq in self.frequencies :
-            freq_params[freq] = {}
-            freq_frame = self.frequencies_widgets[freq]["freq_frame"]
-            for param in ["frequency", "amplitude", "phase", "angle"] :
-                freq_params[freq][param] = freq_frame.get(param)
-        return freq_params
-    
     def set_frequency_param(self, params) :
-        for freq_label, param_dict in params.items() :
-            self.frequencies_widgets[freq_label]["freq_frame"].set(param_dict)
+        with self.batch() :
+            self.model.set_params(params)
+            # Only the visible rows have widgets to update
+            for label, freq_frame in self.visible.items() :
+                if label in params :
+                    freq_frame.show(label, self.model.params[label])
 
 
     def load_frequencies(self, filename) :
         freq_dict = load_frequencies_dict(filename)
-        self.build(freq_dict)
-        self.callback()
+        with self.batch() :
+            self.model.replace(freq_dict)
+            self.build()
 
     def save_frequencies(self, filename) :
         freq_params = self.get_frequencies_param()
@@ -124,13 +126,13 @@ if __name__ == "__main__" :
     root = Tk()
     root.title("FrequencyEditor Test")
 
-    def on_change(widget) :
-        print("Change !")
+    def on_change(widget, change) :
+        print("Change !", change)
         print(widget.get_frequencies_param())
 
     frequency_editor = FrequencyEditor(
         root,
-        callback=lambda: on_change(frequency_editor)
+        callback=lambda change: on_change(frequency_editor, change)
     )
 
     frequency_editor.grid(column=0, row=0, sticky="news")
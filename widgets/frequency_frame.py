@@ -1,6 +1,7 @@
 from tkinter import *
 from tkinter import ttk
 from widgets.entry_bundle import EntryBundle
+from core.events import Change
 
 class FrequencyFrame(ttk.Frame) :
     def __init__(
@@ -8,9 +9,15 @@ class FrequencyFrame(ttk.Frame) :
             root,
             name,
             callback,
-            params_dict=None
+            label=None,
     ) :
         super().__init__(root)
+        # The callback receives a Change naming the edited parameter and the frequency label
+        # Rows start with the default params, show() fills them with a frequency
+        self.label = label
+        self.callback = callback
+        # Values set by show() are not notified
+        self.silent = False
 
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -22,28 +29,19 @@ class FrequencyFrame(ttk.Frame) :
 
         # Create a label (frequency name)
         self.name = name
-        freq_label = ttk.Label(frame, text=name)
-        freq_label.grid(column=0, columnspan=2, row=0, sticky="news")
+        self.name_label = ttk.Label(frame, text=name)
+        self.name_label.grid(column=0, columnspan=2, row=0, sticky="news")
 
         # Create entries
         # Uniform to align the entries
         uniform = "FreqGroup"
         
-        if params_dict :
-            params = {
-                "frequency": ("Frequency (Hz)", params_dict["frequency"], 0.1, 100.0),
-                "amplitude": ("Amplitude", params_dict["amplitude"], 0.1, 10),
-                "phase": ("Phase", params_dict["phase"], 0.0, 360.0),
-                "angle": ("Angle", params_dict["angle"], 0.0, 360.0),
-            }
-        else :
-            # Default params
-            params = {
-                "frequency": ("Frequency (Hz)", 1.0, 0.1, 100.0),
-                "amplitude": ("Amplitude", 1.0, 0.1, 10),
-                "phase": ("Phase", 0.0, 0.0, 360.0),
-                "angle": ("Angle", 0.0, 0.0, 360.0),
-            }
+        params = {
+            "frequency": ("Frequency (Hz)", 1.0, 0.1, 100.0),
+            "amplitude": ("Amplitude", 1.0, 0.1, 10),
+            "phase": ("Phase", 0.0, 0.0, 360.0),
+            "angle": ("Angle", 0.0, 0.0, 360.0),
+        }
         positions = [(0,1), (1,1), (0,2), (1,2)]
         
         # Build the widgets
@@ -56,11 +54,29 @@ class FrequencyFrame(ttk.Frame) :
                 from_=from_,
                 to=to,
                 uniform=uniform,
-                callback=callback,
+                callback=lambda param=bundle_name: self.on_edit(param),
             )
             bundle.grid(column=column, row=row, sticky="news")
             setattr(self, f"{bundle_name}_bundle", bundle)
 
+    def on_edit(self, param) :
+        if not self.silent :
+            self.callback(Change(param, self.label))
+
+    def show(self, label, params_dict, name=None) :
+        # Display another frequency in the same widgets (rows recycled by a virtual list), nothing is notified
+        self.label = label
+        self.name = name if name is not None else "Frequency " + str(label)
+        self.name_label.config(text=self.name)
+        self.silent = True
+        try :
+            for param, value in params_dict.items() :
+                bundle = getattr(self, f"{param}_bundle", None)
+                if bundle is not None :
+                    bundle.set(value)
+        finally :
+            self.silent = False
+
     def get(self, param) :
         param_mapping = {
             "frequency" : self.frequency_bundle,
@@ -69,27 +85,14 @@ class FrequencyFrame(ttk.Frame) :
             "angle" : self.angle_bundle,
         }
         return param_mapping[param].get()
-    
-    def set(self, param_dict) :
-        param_mapping = {
-            "frequency" : self.frequency_bundle,
-            "amplitude" : self.amplitude_bundle,
-            "phase" : self.phase_bundle,
-            "angle" : self.angle_bundle,
-        }
-        for param, value in param_dict.items() :
-            if param in param_mapping.keys() :
-                if param in ["angle", "phase"] :
-                    value = value % 360.0
-                param_mapping[param].set(value)
-    
+
 
 if __name__ == "__main__" :
     root = Tk()
     root.title("FrequencyFrame Test")
 
-    def on_change(frequency_frame) :
-        print(f"{frequency_frame.name} changed values !")
+    def on_change(frequency_frame, change) :
+        print(f"{frequency_frame.name} changed values ! ({change})")
         for param in ["frequency", "amplitude", "phase", "angle"] :
             print(f"{param} : {frequency_frame.get(param)} ")
         print("\n")
@@ -97,7 +100,8 @@ if __name__ == "__main__" :
     frequency_frame = FrequencyFrame(
         root,
         name="1",
-        callback=lambda: on_change(frequency_frame)
+        label=1,
+        callback=lambda change: on_change(frequency_frame, change)
     )
     frequency_frame.grid(column=0, row=0, sticky="news")
 
@@ -51,6 +51,96 @@ class ScrolledFrame(Frame):
         self.canvas.bind("<Configure>", self.resize)
 
 
+class VirtualScrolledFrame(ScrolledFrame) :
+    # Scrolled list of items shown in rows of the same height, only the visible rows have widgets
+    # make_row(parent) creates a row widget, bind_row(row, index) shows the item index in an existing row
+    # Rows are recycled while scrolling (item i is always shown by row i % number of rows),
+    # the scroll region is sized for every item
+    def __init__(self, root, make_row, bind_row, vertical=True, horizontal=False, overscan=1) :
+        super().__init__(root, vertical, horizontal)
+        self.make_row = make_row
+        self.bind_row = bind_row
+        self.overscan = overscan
+
+        self.nb_items = 0
+        self.row_height = None
+        # Row widgets with their canvas window, and the item shown by each row (None when hidden)
+        self.rows = []
+        self.bound = []
+
+        if vertical :
+            self.canvas.configure(yscrollcommand=self.on_scroll)
+        self.canvas.bind("<Configure>", self.resize)
+
+    def on_scroll(self, first, last) :
+        self.vsbar.set(first, last)
+        self.layout()
+
+    def new_row(self) :
+        row = self.make_row(self.canvas)
+        window = self.canvas.create_window(0, 0, window=row, anchor="nw", state="hidden", width=self.canvas.winfo_width())
+        self.rows.append((row, window))
+        self.bound.append(None)
+        if self.row_height is None :
+            # Every row has the height of the first one
+            row.update_idletasks()
+            self.row_height = max(1, row.winfo_reqheight())
+            self.canvas.configure(yscrollincrement=self.row_height)
+
+    def set_count(self, nb_items) :
+        self.nb_items = nb_items
+        self.resize()
+
+    def resize(self, event=None) :
+        if self.row_height is None :
+            self.new_row()
+        width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, width, self.nb_items * self.row_height))
+        for _, window in self.rows :
+            self.canvas.itemconfig(window, width=width)
+        self.layout()
+
+    def visible_range(self) :
+        first = max(0, int(self.canvas.canvasy(0)) // self.row_height)
+        count = self.canvas.winfo_height() // self.row_height + 1 + self.overscan
+        return first, min(self.nb_items, first + count)
+
+    def layout(self, rebind=False) :
+        # Show the visible items, rows already showing their item are left untouched unless rebind
+        if self.row_height is None :
+            return
+        first, last = self.visible_range()
+        if len(self.rows) < last - first :
+            while len(self.rows) < last - first :
+                self.new_row()
+            # The item to row mapping changed
+            rebind = True
+        nb_rows = len(self.rows)
+        visible = set(range(first, last))
+        for slot, (row, window) in enumerate(self.rows) :
+            index = first + (slot - first) % nb_rows
+            if index in visible :
+                if rebind or self.bound[slot] != index :
+                    self.bind_row(row, index)
+                    self.bound[slot] = index
+                    self.canvas.coords(window, 0, index * self.row_height)
+                self.canvas.itemconfig(window, state="normal")
+            elif self.bound[slot] is not None :
+                self.bound[slot] = None
+                self.canvas.itemconfig(window, state="hidden")
+
+    def refresh(self) :
+        # Items changed, show them again
+        self.layout(rebind=True)
+
+    def see(self, index) :
+        # Scroll so the item is visible
+        if self.row_height is None or self.nb_items == 0 :
+            return
+        first, last = self.visible_range()
+        if not first <= index < last - self.overscan :
+            self.canvas.yview_moveto(index / self.nb_items)
+
 
 if __name__ == "__main__" :
     root = Tk()
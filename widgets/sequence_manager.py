@@ -1,57 +1,227 @@
 from tkinter import *
 from tkinter import ttk
 from widgets.save_manager import SaveManager
-from core.sequence import SequencePlayer, load_sequence_config, make_sequence
+from widgets.entry_bundle import EntryBundle
+from core.sequence import SequencePlayer, load_sequence_config, make_keyframe_sequence
+from core.framestore import FrameStore, SequencePrerenderer, default_cache_dir, frames_key, frame_shape, DEFAULT_CACHE_SIZE
+import copy
 import os
+import time
 
 class SequenceManager(ttk.Frame) :
-    def __init__(self, root, initialdir, sequence=None, callback=None) :
+    # callback(step) applies a step to the editor (live rendering)
+    # With frame_callback and render_params (function returning the current RenderParams), the loaded
+    # sequence can be pre-rendered to disk : playback then only hands the stored frames to frame_callback
+    # Sequences are evaluated on demand from their keypoints, at any playback fps, and can be scrubbed and looped
+    # dtype and fft_backend are those of the live renderer, cache_size bounds the disk space of the stored frames
+    # on_play() is called on the main thread when the player starts delivering steps (start, resume, scrub)
+    def __init__(self, root, initialdir, sequence=None, callback=None, frame_callback=None, render_params=None, cache_dir=None, dtype="float64", fft_backend=None, cache_size=DEFAULT_CACHE_SIZE, on_play=None) :
         super().__init__(root)
 
+        self.callback = callback
+        self.frame_callback = frame_callback
+        self.on_play = on_play
+        self.render_params = render_params
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self.cache_size = cache_size
+        self.dtype = dtype
+        self.fft_backend = fft_backend
+        self.sequence_config = None
+        self.prerenderer = None
+        self.store = None
+        self.use_frames = False
+        # Set while the fps entry is filled by the program, not by the user
+        self.setting_fps = False
+        # Time of the last user move of the time scale, the scale does not follow the player right after it
+        self.last_scrub = 0.0
+
         self.sequence=sequence
         if sequence is not None :
-            self.timestep = len(sequence)
+            self.timestep = sequence.timestep
         else :
             self.timestep = None
 
         # Mainframe
         mainframe = ttk.Frame(self)
         mainframe.grid(column=0, row=0, sticky="news")
-        mainframe.grid_columnconfigure((0,1,2,3,4), weight=1)
-        mainframe.grid_rowconfigure((0,1), weight=1)
+        mainframe.grid_columnconfigure((0,1,2,3,4,5), weight=1)
+        mainframe.grid_rowconfigure((0,1,2,3), weight=1)
 
         # Load button
         self.save_manager = SaveManager(mainframe, initialdir, self.load_sequence, load=True, save=False)
         self.save_manager.grid(column=0, row=0, sticky="news")
 
         # SequencePlayer
-        self.player = SequencePlayer(sequence=sequence, callback=callback)
-        ttk.Button(mainframe, text="Start", command=self.player.start).grid(column=1, row=0, sticky="news")
+        self.player = SequencePlayer(sequence=sequence, callback=self.on_player_step)
+        ttk.Button(mainframe, text="Start", command=self.start).grid(column=1, row=0, sticky="news")
         ttk.Button(mainframe, text="Pause", command=self.player.pause).grid(column=2, row=0, sticky="news")
-        ttk.Button(mainframe, text="Resume", command=self.player.resume).grid(column=3, row=0, sticky="news")
+        ttk.Button(mainframe, text="Resume", command=self.resume).grid(column=3, row=0, sticky="news")
         ttk.Button(mainframe, text="Stop", command=self.player.stop).grid(column=4, row=0, sticky="news")
+        if frame_callback is not None and render_params is not None :
+            ttk.Button(mainframe, text="Pre-render", command=self.prerender).grid(column=5, row=0, sticky="news")
 
         # Label to display informations
         self.label = ttk.Label(mainframe, text="Sequence Manager infos")
-        self.label.grid(column=0, columnspan=4, row=1, sticky="news")
+        self.label.grid(column=0, columnspan=6, row=1, sticky="news")
+
+        # Time scale, seek and scrub
+        self.time_var = DoubleVar(value=0.0)
+        self.time_scale = ttk.Scale(mainframe, orient="horizontal", from_=0.0, to=1.0, variable=self.time_var, command=self.scrub)
+        self.time_scale.grid(column=0, columnspan=6, row=2, sticky="ew")
+
+        # Loop and playback fps
+        self.loop_var = IntVar(value=0)
+        ttk.Checkbutton(mainframe, text="Loop", variable=self.loop_var, onvalue=1, offvalue=0, command=lambda: self.player.set_loop(bool(self.loop_var.get()))).grid(column=0, row=3, sticky="w")
+        self.fps_bundle = EntryBundle(mainframe, name="FPS", type="double", default_value=10.0, callback=self.on_fps)
+        self.fps_bundle.grid(column=1, columnspan=2, row=3, sticky="ew")
 
         # Padding
         for child in mainframe.winfo_children() :
             child.grid_configure(padx=2)
 
+        self.follow_player()
+
     def set_load_command(self, load_command) :
         self.save_manager.set_load_command(load_command)
 
     def load_sequence(self, filename) :
         self.player.stop()
+        self.cancel_prerender()
         sequence_config = load_sequence_config(filename)
-        self.timestep = sequence_config["timestep"]
-        self.sequence = make_sequence(sequence_config)
+        # Kept to identify pre-rendered frames
+        self.sequence_config = copy.deepcopy(sequence_config)
+        # Only the keypoints are loaded, steps are evaluated when played
+        self.sequence = make_keyframe_sequence(sequence_config)
+        self.timestep = self.sequence.timestep
         self.player.set_timestep(self.timestep)
         self.player.set_sequence(self.sequence)
+        self.player.seek(0)
+        self.time_scale.configure(from_=self.sequence.t_start, to=self.sequence.t_end)
+        self.time_var.set(self.sequence.t_start)
+        # Authored rate by default, shown rounded without resampling the sequence
+        self.setting_fps = True
+        try :
+            self.fps_bundle.set(round(1.0 / self.timestep, 3))
+        finally :
+            self.setting_fps = False
+        self.show_info()
+
+    def show_info(self) :
         nb_steps = len(self.sequence)
-        total_time = nb_steps * self.timestep
-        self.label.config(text=f"Loaded sequence : {nb_steps} steps - {total_time:.2f} seconds")
+        self.label.config(text=f"Loaded sequence : {nb_steps} steps - {self.sequence.duration:.2f} seconds - {1.0 / self.timestep:.3g} fps")
+
+    def on_fps(self) :
+        # Playback fps, the sequence is sampled again from the keypoints at the new rate
+        try :
+            fps = float(self.fps_bundle.get())
+        except (TclError, ValueError) :
+            return
+        if self.setting_fps or self.sequence is None or fps <= 0 or abs(1.0 / fps - self.timestep) < 1e-12 :
+            return
+        # A pre-render iterates the sequence being resampled, its frames are for the old rate anyway
+        self.cancel_prerender()
+        self.timestep = 1.0 / fps
+        # Under the player lock, a playing thread sees the whole change or none of it
+        self.player.resample(self.timestep)
+        self.show_info()
+
+    def frames_key(self, params) :
+        # Frames depend on the playback fps too
+        return frames_key(dict(self.sequence_config, timestep=self.timestep), params)
+
+    def current_frames_key(self) :
+        return self.frames_key(self.render_params())
+
+    def prerender(self) :
+        # Render every step of the loaded sequence in the background, with the current display settings
+        if self.sequence is None or self.render_params is None :
+            return
+        self.cancel_prerender()
+        params = self.render_params()
+        try :
+            self.store = FrameStore(self.cache_dir, self.frames_key(params), len(self.sequence), frame_shape(params), self.cache_size)
+        except ValueError as error :
+            self.label.config(text=f"Cannot pre-render : {error}")
+            return
+        self.prerenderer = SequencePrerenderer(self.sequence, params, self.store, self.dtype, self.fft_backend)
+        self.prerenderer.start()
+        self.show_progress()
+
+    def cancel_prerender(self) :
+        # The thread is joined before the store is released, a new store may reopen (truncate) the same file
+        self.use_frames = False
+        if self.prerenderer is not None :
+            self.prerenderer.cancel(wait=True)
+        if self.store is not None :
+            self.store.close()
+        self.prerenderer = None
+        self.store = None
+
+    def show_progress(self) :
+        if self.prerenderer is None :
+            return
+        done, total = self.prerenderer.progress()
+        self.label.config(text=f"Pre-rendered frames : {done} / {total}")
+        if done < total :
+            self.after(200, self.show_progress)
+
+    def frames_usable(self) :
+        # Stored frames are only used if they match the current settings
+        return self.store is not None and self.store.key == self.current_frames_key()
+
+    def start(self) :
+        if self.sequence is None :
+            return
+        self.use_frames = self.frames_usable()
+        self.notify_play()
+        self.player.start()
+
+    def resume(self) :
+        if self.sequence is None :
+            return
+        self.notify_play()
+        self.player.resume()
+
+    def notify_play(self) :
+        if self.on_play is not None :
+            self.on_play()
+
+    def playing(self) :
+        # True while the player thread delivers steps (not paused)
+        return self.player.thread is not None and self.player.thread.is_alive() and not self.player.paused
+
+    def on_player_step(self, step) :
+        # Called from the player thread
+        self.deliver(self.player.index, step)
+
+    def deliver(self, index, step) :
+        # Called from the player thread too : the mapping is read once, a cancel may close the store meanwhile
+        store = self.store
+        frames = store.frames if store is not None else None
+        if self.use_frames and frames is not None and index < store.nb_done :
+            self.frame_callback(frames[index])
+        elif self.callback :
+            self.callback(step)
+
+    def scrub(self, value) :
+        # Time scale moved by the user : play from there, and show the step now if the player is not running
+        if self.sequence is None :
+            return
+        self.last_scrub = time.monotonic()
+        index = self.sequence.index_at(float(value))
+        # The settings may have changed since the player started
+        self.use_frames = self.frames_usable()
+        self.player.seek(index)
+        if not self.playing() :
+            self.player.index = index
+            self.deliver(index, self.sequence[index])
+            self.notify_play()
+
+    def follow_player(self, interval=100) :
+        # Move the time scale with the playback, except while the user drags it
+        if self.sequence is not None and self.player.index is not None and time.monotonic() - self.last_scrub > 0.3 :
+            self.time_var.set(self.sequence.time_of(self.player.index))
+        self.after(interval, self.follow_player)
 
 
 if __name__ == "__main__" :